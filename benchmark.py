@@ -0,0 +1,368 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Scale presets: sites, buildings per site, floors per building, units per floor, average logs per unit
+SCALES = {
+    "small": (2, 3, 3, 10, 4),
+    "medium": (5, 8, 4, 25, 6),
+    "large": (10, 15, 6, 40, 8),
+}
+
+STATUSES = ["Closed", "Completed", "Issued", "Requested", "On Hold"]
+TRADES = ["Plumber", "Electrician", "Carpenter", "Painter", "HVAC", "Locksmith"]
+PROBLEMS = [
+    "Water leak", "Blocked drain", "Light fitting faulty", "Door closer broken",
+    "Heating not working", "Window will not close", "Ceiling tile stained",
+    "Socket not working", "Lock jammed", "Paint damaged",
+]
+PLACES = ["in ceiling", "near entrance", "by the window", "in corridor", "under sink", "in plant room"]
+
+SCHEMA = [
+    'CREATE TABLE "Site" ("SiteCode" TEXT PRIMARY KEY, "SiteName" TEXT)',
+    'CREATE TABLE "Building" ("Building Code" TEXT PRIMARY KEY, "Building Name" TEXT)',
+    'CREATE TABLE "Floor" ("Floor Code" TEXT PRIMARY KEY, "Floor Name" TEXT)',
+    'CREATE TABLE "Unit" ("UnitID" INTEGER PRIMARY KEY, "Unit Code" TEXT, "Unit Name" TEXT)',
+    'CREATE TABLE "Location" ("LocationID" INTEGER PRIMARY KEY, "UnitID" INTEGER, '
+    '"Building Code" TEXT, "Site Code" TEXT, "Floor Code" TEXT)',
+    'CREATE TABLE "Craftsperson" ("Craftsperson Code" TEXT PRIMARY KEY, '
+    '"Craftsperson Name" TEXT, "Primary Trade" TEXT)',
+    'CREATE TABLE "Combined" ("Activity Log ID" INTEGER PRIMARY KEY, "LocationID" INTEGER, '
+    '"Craftsperson Code" TEXT, "Work Request Status" TEXT, "Requested by" TEXT, '
+    '"Date and Time Requested" TIMESTAMP, "Date and Time Issued" TIMESTAMP, "Work Description" TEXT)',
+]
+TABLES = ["Combined", "Location", "Unit", "Floor", "Building", "Site", "Craftsperson"]
+
+
+def generate_estate(sites, buildings, floors, units, logs_per_unit, seed=0):
+    rng = random.Random(seed)
+    now = datetime(2024, 1, 1)
+    estate = {
+        "Site": [],
+        "Building": [],
+        "Floor": [(str(f), f"Level {f}") for f in range(floors)],
+        "Unit": [],
+        "Location": [],
+        "Craftsperson": [
+            (f"CP{c:03d}", f"Craftsperson {c}", TRADES[c % len(TRADES)]) for c in range(max(10, sites * 4))
+        ],
+        "Combined": [],
+        "plans": [],  # (site code, building code) pairs that get floor plans
+    }
+    unit_id = 0
+    log_id = 0
+
+    for s in range(sites):
+        site_code = f"SY{s + 1:05d}"
+        estate["Site"].append((site_code, f"Synthetic Site {s + 1}"))
+        for b in range(buildings):
+            building_code = f"S{s + 1}B{b + 1}"
+            estate["Building"].append((building_code, f"Building {s + 1}.{b + 1}"))
+            estate["plans"].append((site_code, building_code))
+            for f in range(floors):
+                for u in range(units):
+                    unit_id += 1
+                    unit_code = f"{f}{u + 1:03d}"
+                    estate["Unit"].append((unit_id, unit_code, f"Room {unit_code}"))
+                    estate["Location"].append((unit_id, unit_id, building_code, site_code, str(f)))
+                    for _ in range(rng.randint(0, logs_per_unit * 2)):
+                        log_id += 1
+                        requested = now - timedelta(days=rng.uniform(0, 730))
+                        issued = requested + timedelta(days=rng.uniform(0, 60))
+                        estate["Combined"].append(
+                            (
+                                log_id,
+                                unit_id,
+                                rng.choice(estate["Craftsperson"])[0],
+                                rng.choice(STATUSES),
+                                f"Requester {rng.randint(1, 50)}",
+                                requested.isoformat(sep=" "),
+                                issued.isoformat(sep=" "),
+                                f"{rng.choice(PROBLEMS)} {rng.choice(PLACES)}",
+                            )
+                        )
+    return estate
+
+
+def write_floor_plans(estate, floors, units, diagrams_dir, seed=0):
+    rng = random.Random(seed)
+    os.makedirs(diagrams_dir, exist_ok=True)
+    columns = max(1, int(units ** 0.5))
+
+    for site_code, building_code in estate["plans"]:
+        for f in range(floors):
+            parts = [
+                '<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 4000 4000" width="100%" height="100%">'
+            ]
+            for u in range(units):
+                unit_code = f"{f}{u + 1:03d}"
+                x0 = (u % columns) * 300
+                y0 = (u // columns) * 300
+                x1 = x0 + rng.uniform(60, 280)
+                y1 = y0 + rng.uniform(60, 280)
+                parts.append(
+                    f'<path id="{building_code};{f};{unit_code}" class="a-area" '
+                    f'd="M{x0:.2f},{y0:.2f}L{x1:.2f},{y0:.2f}L{x1:.2f},{y1:.2f}L{x0:.2f},{y1:.2f}z"/>'
+                )
+                parts.append(f'<text x="{(x0 + x1) / 2:.2f}" y="{(y0 + y1) / 2:.2f}">{unit_code}</text>')
+            parts.append("</svg>")
+            with open(os.path.join(diagrams_dir, f"{site_code}-{building_code}-{f}.svg"), "w") as svg:
+                svg.write("".join(parts))
+
+
+def load_sqlite(estate, path):
+    conn = sqlite3.connect(path)
+    for statement in SCHEMA:
+        conn.execute(statement)
+    for table in TABLES:
+        rows = estate[table]
+        placeholders = ", ".join("?" for _ in rows[0])
+        conn.executemany(f'INSERT INTO "{table}" VALUES ({placeholders})', rows)
+    conn.commit()
+    conn.close()
+
+
+def load_postgres(estate, dsn):
+    import psycopg2
+    from psycopg2.extras import execute_values
+
+    conn = psycopg2.connect(dsn)
+    cursor = conn.cursor()
+    for table in TABLES:
+        cursor.execute(f'DROP TABLE IF EXISTS "{table}"')
+    for statement in SCHEMA:
+        cursor.execute(statement)
+    for table in TABLES:
+        execute_values(cursor, f'INSERT INTO "{table}" VALUES %s', estate[table])
+    conn.commit()
+    conn.close()
+
+
+def stage_totals(server):
+    with server.metrics_lock:
+        return {
+            labels[0][1]: entry[1]
+            for (metric, labels), entry in server.histograms.items()
+            if metric == "treemap_stage_seconds"
+        }
+
+
+def time_request(server, client, method, url, **kwargs):
+    before = stage_totals(server)
+    started = time.perf_counter()
+    response = client.open(url, method=method, **kwargs)
+    response.get_data()
+    wall = time.perf_counter() - started
+    after = stage_totals(server)
+    stages = {name: total - before.get(name, 0.0) for name, total in after.items() if total > before.get(name, 0.0)}
+    return response.status_code, wall, stages
+
+
+def summarise(samples):
+    return {
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.mean(samples),
+        "max": max(samples),
+    }
+
+
+def run_case(server, client, name, url, repeat, reset=None, method="GET"):
+    walls = []
+    stages = {}
+    statuses = set()
+    for _ in range(repeat):
+        if reset:
+            reset()
+        status, wall, request_stages = time_request(server, client, method, url)
+        statuses.add(status)
+        walls.append(wall)
+        for stage, elapsed in request_stages.items():
+            stages.setdefault(stage, []).append(elapsed)
+
+    print(f"{name:<28} median {statistics.median(walls) * 1000:9.1f} ms  status {sorted(statuses)}")
+    return {
+        "url": url,
+        "status": sorted(statuses),
+        "wall": summarise(walls),
+        "stages": {stage: summarise(samples) for stage, samples in sorted(stages.items())},
+    }
+
+
+def run_benchmarks(server, estate, repeat, workdir):
+    client = server.app.test_client()
+    site_code, building_code = estate["plans"][0]
+    floor_code = estate["Floor"][0][0]
+    unit_code = next(code for _, code, _ in estate["Unit"])
+    floor_path = f"{site_code}:{building_code}:{floor_code}"
+
+    def reset_all():
+        client.post("/clear_cache_and_filters")
+
+    def reset_renders():
+        # Keep the hierarchy, drop the rendered output
+        server.cache.clear()
+        server.layout_cache.clear()
+
+    results = {}
+    results["generate_svg_site_cold"] = run_case(
+        server, client, "generate_svg site (cold)", "/generate_svg?level=site", repeat, reset_all
+    )
+    results["generate_svg_site_warm"] = run_case(
+        server, client, "generate_svg site (warm)", "/generate_svg?level=site", repeat
+    )
+    results["generate_svg_building"] = run_case(
+        server, client, "generate_svg building",
+        f"/generate_svg?level=building&parent_code={site_code}", repeat, reset_renders,
+    )
+    results["generate_svg_floor"] = run_case(
+        server, client, "generate_svg floor",
+        f"/generate_svg?level=floor&parent_code={site_code}:{building_code}", repeat, reset_renders,
+    )
+    results["generate_svg_unit"] = run_case(
+        server, client, "generate_svg unit",
+        f"/generate_svg?level=unit&parent_code={floor_path}", repeat, reset_renders,
+    )
+    results["generate_svg_building_plan"] = run_case(
+        server, client, "generate_svg building plan",
+        f"/generate_svg?level=unit&parent_code={floor_path}&visualization_type=building-plans",
+        repeat, reset_renders,
+    )
+    results["generate_svg_filtered"] = run_case(
+        server, client, "generate_svg site (filtered)",
+        "/generate_svg?level=site&work_request_status=Closed,Completed", repeat,
+    )
+    reset_all()
+    results["get_unit_problems"] = run_case(
+        server, client, "get_unit_problems",
+        f"/get_unit_problems?unit_code={floor_path}:{unit_code}", repeat,
+    )
+    results["get_filter_options"] = run_case(
+        server, client, "get_filter_options", "/get_filter_options", repeat
+    )
+
+    # Restart from a persisted hierarchy: the bundle is written once, synchronously,
+    # then every repeat forgets everything in memory and maps it again
+    snapshot_dir = os.path.join(workdir, "snapshot")
+    shutil.rmtree(snapshot_dir, ignore_errors=True)
+    server.snapshot_dir = snapshot_dir
+    reset_all()
+    save_async = server.save_persisted_hierarchy_async
+    server.save_persisted_hierarchy_async = server.save_persisted_hierarchy
+    client.get("/generate_svg?level=site")
+    server.save_persisted_hierarchy_async = save_async
+
+    def restart():
+        reset_all()
+        server.persisted.update(name=None, manifest=None, columns=None)
+
+    results["generate_svg_site_snapshot"] = run_case(
+        server, client, "generate_svg site (snapshot)", "/generate_svg?level=site", repeat, restart
+    )
+    server.snapshot_dir = ""
+    return results
+
+
+def setup_server(args, estate, workdir):
+    diagrams_dir = os.path.join(workdir, "Diagrams")
+    write_floor_plans(estate, args.floors, args.units, diagrams_dir, args.seed)
+    # Set before importing so that unit-sizing pool workers see it as well
+    os.environ["TREEMAP_DIAGRAMS_DIR"] = diagrams_dir
+    # Persisted snapshots would turn the cold cases warm, the snapshot case enables them itself
+    os.environ["TREEMAP_SNAPSHOT_DIR"] = ""
+
+    import server
+
+    if args.backend == "postgres":
+        load_postgres(estate, args.dsn)
+        server.database_config = {"dsn": args.dsn}
+    else:
+        db_file = os.path.join(workdir, "estate.sqlite")
+        load_sqlite(estate, db_file)
+        server.get_postgres_connection = lambda: sqlite3.connect(db_file)
+    return server
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the treemap server against a synthetic estate.")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--sites", type=int)
+    parser.add_argument("--buildings", type=int, help="Buildings per site")
+    parser.add_argument("--floors", type=int, help="Floors per building")
+    parser.add_argument("--units", type=int, help="Units per floor")
+    parser.add_argument("--logs", type=int, help="Average activity logs per unit")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--backend", choices=["sqlite", "postgres"], default="sqlite",
+        help="sqlite runs an in-process stand-in, postgres needs --dsn",
+    )
+    parser.add_argument("--dsn", help="DSN of a throwaway Postgres database, its tables are dropped and recreated")
+    parser.add_argument("--workdir", help="Directory for generated files, defaults to a temporary directory")
+    parser.add_argument("--output", help="Write the JSON results to this file")
+    args = parser.parse_args()
+
+    if args.backend == "postgres" and not args.dsn:
+        parser.error("--backend postgres requires --dsn")
+
+    preset = SCALES[args.scale]
+    for name, default in zip(("sites", "buildings", "floors", "units", "logs"), preset):
+        if getattr(args, name) is None:
+            setattr(args, name, default)
+    return args
+
+
+def main():
+    args = parse_args()
+    estate = generate_estate(args.sites, args.buildings, args.floors, args.units, args.logs, args.seed)
+    print(
+        f"Synthetic estate: {len(estate['Site'])} sites, {len(estate['Building'])} buildings, "
+        f"{len(estate['Unit'])} units, {len(estate['Combined'])} activity logs"
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = args.workdir or tmp
+        os.makedirs(workdir, exist_ok=True)
+        # Background prefetches would add their stages to whichever request is being timed
+        os.environ["TREEMAP_PREFETCH_TILES"] = "0"
+        server = setup_server(args, estate, workdir)
+        results = run_benchmarks(server, estate, args.repeat, workdir)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "backend": args.backend,
+            "scale": {
+                "sites": args.sites,
+                "buildings": args.buildings,
+                "floors": args.floors,
+                "units": args.units,
+                "logs": args.logs,
+                "seed": args.seed,
+            },
+            "repeat": args.repeat,
+            "activity_logs": len(estate["Combined"]),
+        },
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import axios from 'axios';
 import CircularProgress from '@mui/material/CircularProgress';
 import Box from '@mui/material/Box';
@@ -33,6 +33,9 @@ const Treemap = () => {
   const [parentCode, setParentCode] = useState('');
   const [modalOpen, setModalOpen] = useState(false);
   const [problems, setProblems] = useState([]);
+  // Problems for every unit on the current floor, keyed by site:building:floor:unit
+  const floorProblems = useRef({});
+  const floorProblemsRequest = useRef(0);
 
   const fetchSvgData = async () => {
     setLoading(true);
@@ -65,6 +68,30 @@ const Treemap = () => {
     }
   };
 
+  const fetchFloorProblems = async () => {
+    // Only the latest request may fill the cache, older responses can arrive after it
+    const request = ++floorProblemsRequest.current;
+    floorProblems.current = {};
+    if (level !== 'unit' || parentCode.split(':').length !== 3) {
+      return;
+    }
+    try {
+      const response = await axios.post('/get_unit_problems_batch', { floor: parentCode }, {
+        params: {
+          work_request_status: selectedFilters.work_request_status?.join(',') || '',
+          craftsperson_name: selectedFilters.craftsperson_name?.join(',') || '',
+          primary_trade: selectedFilters.primary_trade?.join(',') || '',
+          time_to_complete: selectedFilters.time_to_complete?.join(',') || '',
+        }
+      });
+      if (request === floorProblemsRequest.current) {
+        floorProblems.current = response.data.units;
+      }
+    } catch (err) {
+      console.error('Error prefetching floor problems:', err);
+    }
+  };
+
   const fetchFilterOptions = async () => {
     try {
       const response = await axios.get('/get_filter_options');
@@ -223,6 +250,14 @@ const Treemap = () => {
       const element = d3.select(this);
       let id = element.attr("id");
       const className = element.attr("class");
+
+      const unitPath = id.includes(';') ? `${parentCode.split(':')[0]}:${id.split(';').join(':')}` : id;
+      const prefetched = floorProblems.current[unitPath];
+      if (prefetched && !prefetched.truncated) {
+        setProblems(prefetched.problems);
+        setModalOpen(true);
+        return;
+      }
   
       try {
         const response = await fetch(`/get_unit_problems?unit_code=${id}&work_request_status=${selectedFilters.work_request_status.join(',')}&craftsperson_name=${selectedFilters.craftsperson_name.join(',')}&primary_trade=${selectedFilters.primary_trade.join(',')}&time_to_complete=${selectedFilters.time_to_complete.join(',')}`);
@@ -267,6 +302,10 @@ const Treemap = () => {
     fetchSvgData();
   }, [selectedFilters, visualizationType, level, parentCode]);
 
+  useEffect(() => {
+    fetchFloorProblems();
+  }, [selectedFilters, level, parentCode]);
+
   useEffect(() => {
     if (svgContent) {
       const container = d3.select("#treemap");
@@ -306,6 +345,7 @@ const Treemap = () => {
             <strong>ID:</strong> ${id}<br />
             <strong>Issues:</strong> ${element.attr("data_issues")}<br />
             <strong>Size:</strong> ${element.attr("data_size")}
+            ${element.attr("data_delta") !== null ? `<br /><strong>Change:</strong> ${element.attr("data_delta")}` : ''}
           `);
       });
       attachHoverHandlers();
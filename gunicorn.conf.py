@@ -0,0 +1,29 @@
+import multiprocessing
+import os
+
+# Run with: gunicorn -c gunicorn.conf.py wsgi:app
+bind = os.environ.get("TREEMAP_BIND", "127.0.0.1:5001")
+workers = int(os.environ.get("TREEMAP_WORKERS", multiprocessing.cpu_count()))
+threads = int(os.environ.get("TREEMAP_THREADS", 4))
+worker_class = "gthread"
+timeout = 300  # Building an unfiltered hierarchy from cold can take a while
+graceful_timeout = 30
+preload_app = False  # Each worker imports the app after forking, so no SQLite or pool state is inherited
+
+
+def on_starting(server):
+    # Split the cores between the web workers' unit-sizing pools
+    os.environ.setdefault("TREEMAP_UNIT_SIZE_WORKERS", str(max(1, multiprocessing.cpu_count() // workers)))
+
+
+def post_worker_init(worker):
+    from server import start_refresh_thread, start_unit_size_pool
+
+    start_unit_size_pool()
+    start_refresh_thread()
+
+
+def worker_exit(server, worker):
+    from server import shutdown_unit_size_pool
+
+    shutdown_unit_size_pool()
@@ -0,0 +1,326 @@
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import signal
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import requests
+
+from benchmark import SCALES, STATUSES, TRADES, generate_estate, setup_server
+
+# Latency metrics compared against a saved baseline
+COMPARED = ("p50", "p95", "p99")
+
+
+def serve(args, estate, workdir, port, ready):
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietRequestHandler(WSGIRequestHandler):
+        # Logging every request would be part of the measured latency
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = setup_server(args, estate, workdir)
+    httpd = make_server("127.0.0.1", port, server.app, threaded=True, request_handler=QuietRequestHandler)
+    # SIGTERM skips atexit, which would leave the unit-sizing pool workers running.
+    # shutdown() waits for serve_forever to return, so it cannot run in the handler's thread.
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=httpd.shutdown).start())
+    ready.set()
+    try:
+        httpd.serve_forever()
+    finally:
+        server.shutdown_unit_size_pool()
+
+
+def start_local_server(args, estate, workdir):
+    ready = multiprocessing.Event()
+    # Not a daemon: the server's unit-sizing pool needs to start child processes of its own.
+    # main() terminates it once the run is over.
+    process = multiprocessing.Process(target=serve, args=(args, estate, workdir, args.port, ready))
+    process.start()
+    if not ready.wait(timeout=300) or not process.is_alive():
+        process.terminate()
+        raise RuntimeError("Local server did not start")
+    return process, f"http://127.0.0.1:{args.port}"
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+
+    def add(self, endpoint, elapsed, ok):
+        with self.lock:
+            latencies, errors = self.samples.setdefault(endpoint, ([], [0]))
+            latencies.append(elapsed)
+            if not ok:
+                errors[0] += 1
+
+
+class ClickStream:
+    # One simulated user drilling down through the estate, with occasional filter changes
+    def __init__(self, base_url, estate, recorder, rng, args):
+        self.base_url = base_url
+        self.recorder = recorder
+        self.rng = rng
+        self.args = args
+        self.session = requests.Session()
+        self.filters = {}
+        self.plans = estate["plans"]
+        self.floors = [code for code, _ in estate["Floor"]]
+        self.units = {}  # Unit codes start with their floor code
+        for _, unit_code, _ in estate["Unit"]:
+            self.units.setdefault(unit_code[:-3], set()).add(unit_code)
+
+    def call(self, endpoint, method, path, **kwargs):
+        params = dict(self.filters, **kwargs.pop("params", {}))
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, params=params, timeout=self.args.timeout, **kwargs)
+            response.content  # Read the whole body
+            # 404 is the server's answer for filters that match nothing
+            ok = response.status_code < 400 or response.status_code == 404
+        except requests.RequestException:
+            ok = False
+        self.recorder.add(endpoint, time.perf_counter() - started, ok)
+        if self.args.think:
+            time.sleep(self.rng.uniform(0, self.args.think * 2) / 1000)
+
+    def change_filters(self):
+        choice = self.rng.random()
+        if choice < 0.4:
+            self.filters = {"work_request_status": ",".join(self.rng.sample(STATUSES, 2))}
+        elif choice < 0.6:
+            self.filters = {"primary_trade": self.rng.choice(TRADES)}
+        elif choice < 0.8:
+            start = date(2022, 1, 1) + timedelta(days=self.rng.randint(0, 600))
+            self.filters = {"from": start.isoformat(), "to": (start + timedelta(days=90)).isoformat()}
+        else:
+            self.filters = {}
+
+    def run_once(self):
+        if self.rng.random() < self.args.filter_rate:
+            self.change_filters()
+            self.call("get_filter_options", "GET", "/get_filter_options")
+        else:
+            self.filters = {}
+
+        site_code, building_code = self.rng.choice(self.plans)
+        floor_code = self.rng.choice(self.floors)
+        floor_path = f"{site_code}:{building_code}:{floor_code}"
+        self.call("generate_svg site", "GET", "/generate_svg", params={"level": "site"})
+        self.call("generate_svg building", "GET", "/generate_svg", params={"level": "building", "parent_code": site_code})
+        self.call(
+            "generate_svg floor", "GET", "/generate_svg",
+            params={"level": "floor", "parent_code": f"{site_code}:{building_code}"},
+        )
+        self.call("generate_svg unit", "GET", "/generate_svg", params={"level": "unit", "parent_code": floor_path})
+        self.call(
+            "generate_svg building plan", "GET", "/generate_svg",
+            params={"level": "unit", "parent_code": floor_path, "visualization_type": "building-plans"},
+        )
+
+        if self.args.backend == "postgres":
+            # The batch endpoint binds psycopg2 parameters, so the SQLite stand-in cannot serve it
+            self.call("get_unit_problems_batch", "POST", "/get_unit_problems_batch", json={"floor": floor_path})
+        floor_units = sorted(self.units.get(floor_code, ()))
+        for unit_code in self.rng.sample(floor_units, min(len(floor_units), self.rng.randint(1, 3))):
+            self.call("get_unit_problems", "GET", "/get_unit_problems", params={"unit_code": f"{floor_path}:{unit_code}"})
+
+
+def run_user(user, base_url, estate, recorder, args, deadline):
+    stream = ClickStream(base_url, estate, recorder, random.Random(args.seed * 1000 + user), args)
+    iterations = 0
+    while time.monotonic() < deadline and (not args.iterations or iterations < args.iterations):
+        stream.run_once()
+        iterations += 1
+
+
+def run_load(base_url, estate, args, duration):
+    recorder = Recorder()
+    deadline = time.monotonic() + duration
+    threads = [
+        threading.Thread(target=run_user, args=(user, base_url, estate, recorder, args, deadline))
+        for user in range(args.users)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder, time.perf_counter() - started
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def summarise(recorder, elapsed):
+    results = {}
+    for endpoint, (latencies, errors) in sorted(recorder.samples.items()):
+        results[endpoint] = {
+            "requests": len(latencies),
+            "errors": errors[0],
+            "error_rate": errors[0] / len(latencies),
+            "throughput": len(latencies) / elapsed,
+            "mean": sum(latencies) / len(latencies),
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+        }
+    return results
+
+
+def print_results(results):
+    print(f"{'endpoint':<28} {'reqs':>7} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for endpoint, result in results.items():
+        print(
+            f"{endpoint:<28} {result['requests']:>7} {result['throughput']:>8.1f} "
+            f"{result['p50'] * 1000:>9.1f} {result['p95'] * 1000:>9.1f} {result['p99'] * 1000:>9.1f} "
+            f"{result['error_rate']:>6.1%}"
+        )
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    regressions = []
+    print(f"\nCompared with baseline from {baseline['meta']['timestamp']} (tolerance {tolerance:.0%}):")
+    for endpoint, result in results.items():
+        previous = baseline["results"].get(endpoint)
+        if previous is None:
+            print(f"{endpoint:<28} not in baseline")
+            continue
+        changes = []
+        for metric in COMPARED:
+            change = (result[metric] - previous[metric]) / previous[metric] if previous[metric] else 0.0
+            changes.append(f"{metric} {change:+7.1%}")
+            if change > tolerance:
+                regressions.append(f"{endpoint} {metric}")
+        if result["error_rate"] > previous["error_rate"]:
+            regressions.append(f"{endpoint} error_rate")
+        print(f"{endpoint:<28} " + "  ".join(changes) + f"  errors {previous['error_rate']:.1%} -> {result['error_rate']:.1%}")
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay click-stream load against the treemap server.")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--sites", type=int)
+    parser.add_argument("--buildings", type=int, help="Buildings per site")
+    parser.add_argument("--floors", type=int, help="Floors per building")
+    parser.add_argument("--units", type=int, help="Units per floor")
+    parser.add_argument("--logs", type=int, help="Average activity logs per unit")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--backend", choices=["sqlite", "postgres"], default="sqlite",
+        help="sqlite runs an in-process stand-in, postgres needs --dsn",
+    )
+    parser.add_argument("--dsn", help="DSN of a throwaway Postgres database, its tables are dropped and recreated")
+    parser.add_argument("--url", help="Load an already running server instead of starting one (its data must match --scale/--seed)")
+    parser.add_argument("--port", type=int, default=5002, help="Port for the locally started server")
+    parser.add_argument("--users", type=int, default=8, help="Concurrent simulated users")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to run")
+    parser.add_argument("--iterations", type=int, help="Stop each user after this many click-streams")
+    parser.add_argument("--warmup", type=float, default=5, help="Seconds of unrecorded load before measuring")
+    parser.add_argument("--think", type=float, default=0, help="Average pause between requests in milliseconds")
+    parser.add_argument("--filter-rate", type=float, default=0.3, help="Share of click-streams that change filters first")
+    parser.add_argument("--timeout", type=float, default=120, help="Per-request timeout in seconds")
+    parser.add_argument("--workdir", help="Directory for generated files, defaults to a temporary directory")
+    parser.add_argument("--save-baseline", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Compare against a baseline JSON file, exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed latency increase before it counts as a regression")
+    args = parser.parse_args()
+
+    if args.backend == "postgres" and not args.dsn and not args.url:
+        parser.error("--backend postgres requires --dsn")
+
+    preset = SCALES[args.scale]
+    for name, default in zip(("sites", "buildings", "floors", "units", "logs"), preset):
+        if getattr(args, name) is None:
+            setattr(args, name, default)
+    return args
+
+
+def main():
+    args = parse_args()
+    estate = generate_estate(args.sites, args.buildings, args.floors, args.units, args.logs, args.seed)
+    print(
+        f"Synthetic estate: {len(estate['Site'])} sites, {len(estate['Building'])} buildings, "
+        f"{len(estate['Unit'])} units, {len(estate['Combined'])} activity logs"
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = args.workdir or tmp
+        os.makedirs(workdir, exist_ok=True)
+        process = None
+        base_url = args.url
+        if base_url is None:
+            process, base_url = start_local_server(args, estate, workdir)
+        try:
+            if args.warmup:
+                run_load(base_url, estate, args, args.warmup)
+            print(f"Running {args.users} users against {base_url} for {args.duration:g}s")
+            recorder, elapsed = run_load(base_url, estate, args, args.duration)
+        finally:
+            if process is not None:
+                process.terminate()
+                process.join(timeout=60)
+                if process.is_alive():
+                    process.kill()
+
+    results = summarise(recorder, elapsed)
+    print_results(results)
+
+    # A run where an endpoint never succeeded measured nothing, so it must not become a baseline
+    failed = [endpoint for endpoint, result in results.items() if result["error_rate"] == 1]
+    if failed:
+        print("Every request failed for: " + ", ".join(failed))
+        sys.exit(1)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "backend": args.backend,
+            "url": args.url,
+            "scale": {
+                "sites": args.sites,
+                "buildings": args.buildings,
+                "floors": args.floors,
+                "units": args.units,
+                "logs": args.logs,
+                "seed": args.seed,
+            },
+            "users": args.users,
+            "duration": elapsed,
+            "think": args.think,
+            "filter_rate": args.filter_rate,
+        },
+        "results": results,
+    }
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print("Regressions: " + ", ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,11 @@
+import json
 import math
 import re
-from flask import Flask, request, send_from_directory, jsonify
+import struct
+from flask import Flask, Response, g, has_request_context, request, send_from_directory, jsonify
 import psycopg2
 import pyodbc
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.colors as mcolors
@@ -12,7 +15,25 @@ import xml.etree.ElementTree as ET
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from flask_compress import Compress
 import time
+import gzip
+import hashlib
 import copy
+import io
+import atexit
+import pickle
+import select
+import shutil
+import sqlite3
+import cProfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 app = Flask(__name__, static_folder="client/build", static_url_path="")
 Compress(app)
@@ -35,8 +56,289 @@ def get_postgres_connection():
         print(f"Error connecting to PostgreSQL database: {e}")
         return None
 
-output_svg_file = "../Data/treemap.svg"
-cache = {}
+# Request timing and metrics. Stages are recorded into Prometheus-style
+# histograms for /metrics and, inside a request, into flask.g so they can
+# be returned as a Server-Timing header.
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+METRIC_HELP = {
+    "treemap_stage_seconds": ("histogram", "Time spent in each processing stage."),
+    "treemap_request_seconds": ("histogram", "Time spent handling each request."),
+    "treemap_requests_total": ("counter", "Requests handled, by endpoint and status."),
+    "treemap_singleflight_total": ("counter", "Computations executed or joined by coalesced requests."),
+    "treemap_refresh_total": ("counter", "Incremental refresh passes, by whether they applied any rows."),
+    "treemap_refresh_invalidated_total": ("counter", "Cache prefixes dropped by incremental refreshes."),
+    "treemap_prefetch_total": ("counter", "Drill-down prefetches, by level and outcome (prefetched, skipped, hit, miss)."),
+}
+PROFILE_DIR = os.environ.get("TREEMAP_PROFILE_DIR", "profiles")
+allow_profiling = os.environ.get("TREEMAP_ALLOW_PROFILING") == "1"
+
+metrics_lock = threading.Lock()
+histograms = {}
+counters = {}
+
+
+def observe(metric, labels, value):
+    key = (metric, labels)
+    with metrics_lock:
+        entry = histograms.get(key)
+        if entry is None:
+            entry = histograms[key] = [[0] * len(STAGE_BUCKETS), 0.0, 0]
+        for i, bound in enumerate(STAGE_BUCKETS):
+            if value <= bound:
+                entry[0][i] += 1
+        entry[1] += value
+        entry[2] += 1
+
+
+def increment(metric, labels=(), amount=1):
+    key = (metric, labels)
+    with metrics_lock:
+        counters[key] = counters.get(key, 0) + amount
+
+
+def record_stage(name, elapsed):
+    observe("treemap_stage_seconds", (("stage", name),), elapsed)
+    if has_request_context():
+        g.setdefault("stage_timings", []).append((name, elapsed))
+
+
+@contextmanager
+def timed_stage(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+def render_metrics():
+    lines = []
+    with metrics_lock:
+        histogram_items = sorted((key, (list(entry[0]), entry[1], entry[2])) for key, entry in histograms.items())
+        counter_items = sorted(counters.items())
+
+    described = set()
+    for (metric, labels), (buckets, total, count) in histogram_items:
+        if metric not in described:
+            metric_type, help_text = METRIC_HELP.get(metric, ("histogram", metric))
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} {metric_type}")
+            described.add(metric)
+        for bound, bucket_count in zip(STAGE_BUCKETS, buckets):
+            lines.append(f"{metric}_bucket{format_labels(labels, [('le', bound)])} {bucket_count}")
+        lines.append(f"{metric}_bucket{format_labels(labels, [('le', '+Inf')])} {count}")
+        lines.append(f"{metric}_sum{format_labels(labels)} {total:.6f}")
+        lines.append(f"{metric}_count{format_labels(labels)} {count}")
+
+    for (metric, labels), value in counter_items:
+        if metric not in described:
+            metric_type, help_text = METRIC_HELP.get(metric, ("counter", metric))
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} {metric_type}")
+            described.add(metric)
+        lines.append(f"{metric}{format_labels(labels)} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+@app.before_request
+def start_request_timing():
+    g.request_started = time.perf_counter()
+    g.profiler = None
+    if allow_profiling and request.args.get("profile") == "1":
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already running in this process
+            return
+        g.profiler = profiler
+
+
+@app.after_request
+def finish_request_timing(response):
+    started = g.get("request_started", time.perf_counter())
+    elapsed = time.perf_counter() - started
+    endpoint = request.endpoint or "static"
+    increment("treemap_requests_total", (("endpoint", endpoint), ("status", response.status_code)))
+
+    timings = [f"{name};dur={duration * 1000:.1f}" for name, duration in g.get("stage_timings", [])]
+    if response.is_streamed:
+        # The body is generated after the headers are sent, so its serialization
+        # stage and the full request time only reach the histograms, once it closes
+        response.call_on_close(
+            lambda: observe("treemap_request_seconds", (("endpoint", endpoint),), time.perf_counter() - started)
+        )
+        timings.append('streamed;desc="serialization and total are in /metrics only"')
+    else:
+        observe("treemap_request_seconds", (("endpoint", endpoint),), elapsed)
+        timings.append(f"total;dur={elapsed * 1000:.1f}")
+    response.headers["Server-Timing"] = ", ".join(timings)
+
+    profiler = g.get("profiler")
+    if profiler is not None:
+        profiler.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profile_file = os.path.join(PROFILE_DIR, f"{endpoint}-{int(time.time() * 1000)}.prof")
+        profiler.dump_stats(profile_file)
+        response.headers["X-Profile-File"] = profile_file
+
+    return response
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+
+# Cache shared by every worker process through SQLite, used when several
+# workers serve the app so that they do not each redo the same renders.
+class SharedCache:
+    def __init__(self, path, table, max_entries=None):
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries  # Oldest writes are dropped beyond this
+        self.local = threading.local()
+        conn = self.connect()
+        conn.execute(f'CREATE TABLE IF NOT EXISTS "{table}" (key TEXT PRIMARY KEY, value BLOB)')
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)")
+        conn.commit()
+
+    def connect(self):
+        # SQLite connections must not cross threads or forks
+        if getattr(self.local, "pid", None) != os.getpid():
+            self.local.conn = sqlite3.connect(self.path, timeout=30)
+            self.local.conn.execute("PRAGMA journal_mode=WAL")
+            self.local.pid = os.getpid()
+        return self.local.conn
+
+    def __contains__(self, key):
+        row = self.connect().execute(f'SELECT 1 FROM "{self.table}" WHERE key = ?', (key,)).fetchone()
+        return row is not None
+
+    def __getitem__(self, key):
+        row = self.connect().execute(f'SELECT value FROM "{self.table}" WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return pickle.loads(row[0])
+
+    def get(self, key, default=None):
+        # A single query, so another worker clearing the key cannot slip in between
+        row = self.connect().execute(f'SELECT value FROM "{self.table}" WHERE key = ?', (key,)).fetchone()
+        return default if row is None else pickle.loads(row[0])
+
+    def __setitem__(self, key, value):
+        conn = self.connect()
+        conn.execute(
+            f'INSERT OR REPLACE INTO "{self.table}" (key, value) VALUES (?, ?)',
+            (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL)),
+        )
+        if self.max_entries:
+            # INSERT OR REPLACE gives the row a new rowid, so rowid order is write order
+            conn.execute(
+                f'DELETE FROM "{self.table}" WHERE rowid <= '
+                f'(SELECT rowid FROM "{self.table}" ORDER BY rowid DESC LIMIT 1 OFFSET ?)',
+                (self.max_entries,),
+            )
+        conn.commit()
+
+    def clear(self):
+        conn = self.connect()
+        conn.execute(f'DELETE FROM "{self.table}"')
+        conn.commit()
+
+    def discard_prefix(self, prefix):
+        conn = self.connect()
+        conn.execute(f'DELETE FROM "{self.table}" WHERE substr(key, 1, ?) = ?', (len(prefix), prefix))
+        conn.commit()
+
+    def bump_generation(self):
+        conn = self.connect()
+        conn.execute(
+            "INSERT INTO meta (name, value) VALUES ('generation', 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1"
+        )
+        conn.commit()
+
+    def meta(self):
+        return dict(self.connect().execute("SELECT name, value FROM meta").fetchall())
+
+    def raise_high_water_mark(self, value):
+        conn = self.connect()
+        conn.execute(
+            "INSERT INTO meta (name, value) VALUES ('high_water_mark', ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = MAX(value, excluded.value)",
+            (value,),
+        )
+        conn.commit()
+
+    def reset_high_water_mark(self):
+        conn = self.connect()
+        conn.execute("DELETE FROM meta WHERE name = 'high_water_mark'")
+        conn.commit()
+
+
+class BoundedCache:
+    # In-process cache that evicts the least recently used entries beyond max_entries
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __iter__(self):
+        return iter(list(self.entries))
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                return default
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self.lock:
+            return self.entries.pop(key, default)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+diagrams_dir = os.environ.get("TREEMAP_DIAGRAMS_DIR", "../Data/Diagrams")
+shared_cache_dir = os.environ.get("TREEMAP_SHARED_CACHE_DIR")
+# Layouts are keyed by the client's window size as well, so they are capped
+layout_cache_entries = int(os.environ.get("TREEMAP_LAYOUT_CACHE_ENTRIES", 256))
+if shared_cache_dir:
+    os.makedirs(shared_cache_dir, exist_ok=True)
+    shared_cache_file = os.path.join(shared_cache_dir, "cache.sqlite")
+    cache = SharedCache(shared_cache_file, "svg")
+    layout_cache = SharedCache(shared_cache_file, "layout", layout_cache_entries)
+    geometry_cache = SharedCache(shared_cache_file, "geometry")
+    artifact_cache = SharedCache(shared_cache_file, "artifacts")
+else:
+    cache = {}
+    layout_cache = BoundedCache(layout_cache_entries)  # Computed treemap tiles, reused by viewport requests
+    geometry_cache = {}  # Room lengths per floor plan, lives in each pool worker
+    artifact_cache = {}  # Compressed SVGs keyed by content hash and encoding
+seen_cache_generation = 0
+seen_high_water_mark = 0  # Highest refresh another worker has announced that this one has applied
 filter_data = {}  # Global variable to store filter data
 
 class Site:
@@ -151,15 +453,22 @@ def extract_data_from_access(filters):
             ', '.join(f"'{trade.strip()}'" for trade in filters['primary_trade'])
         )
 
-    if 'time_to_complete' in filters and filters['time_to_complete']:
-        time_to_complete_filters = filters['time_to_complete'].split(',')
-        for condition in time_to_complete_filters:
-            if condition == "less_than_10":
-                query += "AND (EXTRACT(EPOCH FROM \"Date and Time Issued\" - \"Date and Time Requested\")/86400) < 10 "
-            elif condition == "10-30":
-                query += "AND (EXTRACT(EPOCH FROM \"Date and Time Issued\" - \"Date and Time Requested\")/86400) BETWEEN 10 AND 30 "
-            elif condition == "more_than_30":
-                query += "AND (EXTRACT(EPOCH FROM \"Date and Time Issued\" - \"Date and Time Requested\")/86400) > 30 "
+    query += time_to_complete_condition(filters)
+    query += date_range_condition(filters)
+
+    # Full-text match on the work description, the treemap then counts matching logs.
+    # Binding a parameter makes % special, so the literal part built so far is escaped.
+    params = None
+    if filters.get('search'):
+        query = query.replace("%", "%%")
+        query += f" AND {SEARCH_VECTOR} @@ plainto_tsquery('{SEARCH_CONFIG}', %(search)s) "
+        params = {"search": filters['search']}
+
+    # Activity Log ID window, used to build up to a high-water mark and to fetch deltas past it
+    if filters.get('min_log_id') is not None:
+        query += f" AND \"Combined\".\"Activity Log ID\" > {int(filters['min_log_id'])} "
+    if filters.get('max_log_id') is not None:
+        query += f" AND \"Combined\".\"Activity Log ID\" <= {int(filters['max_log_id'])} "
 
     query += """
     GROUP BY 
@@ -173,20 +482,81 @@ def extract_data_from_access(filters):
         "Unit"."Unit Name";
     """
 
-    print(f"Executing query: {query}")
-    cursor = conn.cursor()
-    cursor.execute(query)
-    rows = cursor.fetchall()
-    conn.close()
-    df = pd.DataFrame.from_records(rows, columns=[desc[0] for desc in cursor.description])
+    with timed_stage("db_query"):
+        cursor = conn.cursor()
+        if params:
+            cursor.execute(query, params)
+        else:
+            cursor.execute(query)
+        rows = cursor.fetchall()
+        conn.close()
+    with timed_stage("dataframe"):
+        df = pd.DataFrame.from_records(rows, columns=[desc[0] for desc in cursor.description])
     return df
 
 
-from concurrent.futures import ProcessPoolExecutor
+# Must match the expression indexed by sql/work_description_search.sql
+SEARCH_CONFIG = "english"
+SEARCH_VECTOR = f"to_tsvector('{SEARCH_CONFIG}', coalesce(\"Combined\".\"Work Description\", ''))"
+SEARCH_MAX_LIMIT = 1000
+
 
-def generate_treemap_data(df, level="site", parent_code=None, batch_size=1500, num_workers=16):
+def time_to_complete_condition(filters):
+    condition = ""
+    if 'time_to_complete' in filters and filters['time_to_complete']:
+        time_to_complete_filters = filters['time_to_complete'].split(',')
+        for value in time_to_complete_filters:
+            if value == "less_than_10":
+                condition += "AND (EXTRACT(EPOCH FROM \"Date and Time Issued\" - \"Date and Time Requested\")/86400) < 10 "
+            elif value == "10-30":
+                condition += "AND (EXTRACT(EPOCH FROM \"Date and Time Issued\" - \"Date and Time Requested\")/86400) BETWEEN 10 AND 30 "
+            elif value == "more_than_30":
+                condition += "AND (EXTRACT(EPOCH FROM \"Date and Time Issued\" - \"Date and Time Requested\")/86400) > 30 "
+    return condition
+
+
+def date_range_condition(filters):
+    # "to" is inclusive, so compare against the start of the following day. The
+    # dates are validated by get_request_filters before reaching the query.
+    condition = ""
+    if filters.get('from'):
+        start = date.fromisoformat(filters['from'])
+        condition += f" AND \"Combined\".\"Date and Time Requested\" >= '{start.isoformat()}' "
+    if filters.get('to'):
+        end = date.fromisoformat(filters['to']) + timedelta(days=1)
+        condition += f" AND \"Combined\".\"Date and Time Requested\" < '{end.isoformat()}' "
+    return condition
+
+
+def bound_filter_conditions(filters, params):
+    # Status, craftsperson and trade conditions bound as psycopg2 parameters.
+    # Returns the SQL and whether it needs the Craftsperson join.
+    conditions = []
+    join_craftsperson = False
+    for name, column in (
+        ("work_request_status", '"Combined"."Work Request Status"'),
+        ("craftsperson_name", '"Craftsperson"."Craftsperson Name"'),
+        ("primary_trade", '"Craftsperson"."Primary Trade"'),
+    ):
+        if filters.get(name):
+            conditions.append(f"AND {column} = ANY(%({name})s)")
+            params[name] = [value.strip() for value in filters[name].split(",")]
+            join_craftsperson = join_craftsperson or column.startswith('"Craftsperson"')
+    return " ".join(conditions), join_craftsperson
+
+
+def previous_period_filters(filters):
+    start = date.fromisoformat(filters["from"])
+    end = date.fromisoformat(filters["to"])
+    length = end - start + timedelta(days=1)
+    return dict(filters, **{"from": (start - length).isoformat(), "to": (start - timedelta(days=1)).isoformat()})
+
+
+from concurrent.futures import ProcessPoolExecutor
+def generate_treemap_data(df, level="site", parent_code=None, batch_size=1500, num_workers=None):
     sites = {}
 
+    started = time.perf_counter()
     for batch in batch_iterator(df.itertuples(index=False, name=None), batch_size):
         for row in batch:
             siteCode = row[4]  # 'SiteCode'
@@ -223,33 +593,64 @@ def generate_treemap_data(df, level="site", parent_code=None, batch_size=1500, n
                 unit = Unit(unitCode, unitName, issueCount)
                 floor.add_unit(unit)
                 floor_units[unitCode] = unit
+    record_stage("hierarchy", time.perf_counter() - started)
 
     if level == "site":
-        timestamp = time.time()
-        with ProcessPoolExecutor(max_workers=num_workers) as executor:
-            futures = {
-                executor.submit(
-                    calculate_and_add_unit_sizes_batch,
-                    floor,
-                    f"{site.siteCode}:{building.buildingCode}:{floor.floorCode}",
-                ): floor
-                for site in sites.values()
-                for building in site.buildings
-                for floor in building.floors
-            }
+        started = time.perf_counter()
+        executor = get_unit_size_pool(num_workers)
+        persisted_sizes = get_persisted_unit_sizes()
+        futures = {}
+        for site in sites.values():
+            for building in site.buildings:
+                for floor in building.floors:
+                    floor_path = f"{site.siteCode}:{building.buildingCode}:{floor.floorCode}"
+                    # Floors already sized in the persisted snapshot skip the floor plan
+                    known_sizes = lookup_persisted_unit_sizes(persisted_sizes, floor_path, floor.units)
+                    if known_sizes is not None:
+                        for unit, size in zip(floor.units, known_sizes):
+                            unit.unitSize = size
+                        continue
+                    futures[executor.submit(calculate_and_add_unit_sizes_batch, floor, floor_path)] = floor
+
+        for future in as_completed(futures):
+            floor = futures[future]
+            for unit_code, size in future.result():
+                floor.units_dict[unit_code].unitSize = size
+
+        record_stage("unit_sizes", time.perf_counter() - started)
 
-            for future in as_completed(futures):
-                floor_results = future.result()
-                for unit_code, size in floor_results:
-                    for site in sites.values():
-                        for building in site.buildings:
-                            for floor in building.floors:
-                                if unit_code in floor.units_dict:
-                                    floor.units_dict[unit_code].unitSize = size
+    return sites
 
-        print(f"Time taken to calculate unit sizes: {time.time() - timestamp:.2f} seconds")
 
-    return sites
+# Floor geometry is sized in a pool that lives as long as the process, started
+# lazily or from the server's startup hook and shut down on exit.
+unit_size_pool = None
+unit_size_pool_lock = threading.Lock()
+
+
+def start_unit_size_pool(num_workers=None):
+    global unit_size_pool
+    with unit_size_pool_lock:
+        if unit_size_pool is None:
+            if num_workers is None:
+                num_workers = int(os.environ.get("TREEMAP_UNIT_SIZE_WORKERS", os.cpu_count() or 1))
+            unit_size_pool = ProcessPoolExecutor(max_workers=num_workers)
+        return unit_size_pool
+
+
+def shutdown_unit_size_pool():
+    global unit_size_pool
+    with unit_size_pool_lock:
+        if unit_size_pool is not None:
+            unit_size_pool.shutdown(wait=True, cancel_futures=True)
+            unit_size_pool = None
+
+
+def get_unit_size_pool(num_workers=None):
+    return unit_size_pool or start_unit_size_pool(num_workers)
+
+
+atexit.register(shutdown_unit_size_pool)
 
 
 def calculate_and_add_unit_sizes_batch(floor, parent_code):
@@ -269,17 +670,18 @@ def batch_iterator(iterator, batch_size):
 
 
 def generate_color_scale(df, column="IssueCount"):
-    df[column] = pd.to_numeric(df[column], errors="coerce")
-    df = df.dropna(subset=[column])
+    with timed_stage("colouring"):
+        df[column] = pd.to_numeric(df[column], errors="coerce")
+        df = df.dropna(subset=[column])
 
-    if df.empty:
-        raise ValueError(
-            f"No valid data in DataFrame after dropping NaNs in column '{column}'."
-        )
+        if df.empty:
+            raise ValueError(
+                f"No valid data in DataFrame after dropping NaNs in column '{column}'."
+            )
 
-    norm = plt.Normalize(df[column].min(), df[column].max())
-    colors = plt.cm.Blues(norm(df[column]))
-    df["Color"] = [mcolors.to_hex(color) for color in colors]
+        norm = plt.Normalize(df[column].min(), df[column].max())
+        colors = plt.cm.Blues(norm(df[column]))
+        df["Color"] = [mcolors.to_hex(color) for color in colors]
 
     return df
 
@@ -287,7 +689,7 @@ def generate_color_scale(df, column="IssueCount"):
 def create_building_plan_visualization(sites, parent_code, output_file, norm):
     print(f"Coloring units for {parent_code}...")
     site_code, building_code, floor_code = parent_code.split(":")
-    svg_file = f"../Data/Diagrams/{site_code}-{building_code}-{floor_code}.svg"
+    svg_file = os.path.join(diagrams_dir, f"{site_code}-{building_code}-{floor_code}.svg")
     
     paths, texts, tree, root = parse_svg(svg_file)
     rooms = generate_room_associations(paths, texts)
@@ -333,18 +735,8 @@ def create_building_plan_visualization(sites, parent_code, output_file, norm):
     tree.write(output_file)
 
 
-def create_interactive_treemap(sites, level, output_file, width, height, min_size=200):
-    svg_ns = "http://www.w3.org/2000/svg"
-    ET.register_namespace("", svg_ns)
-
-    new_svg = ET.Element(
-        "svg",
-        xmlns=svg_ns,
-        viewBox=f"0 0 {width} {height}",
-        width="100%",
-        height="100%",
-    )
-    x, y = 0, 0
+def compute_treemap_tiles(sites, level, width, height, x=0, y=0):
+    started = time.perf_counter()
     site_rects = []
 
     if level == "site":
@@ -465,79 +857,215 @@ def create_interactive_treemap(sites, level, output_file, width, height, min_siz
                         }
                         site_rects.append(unit_rect)
 
-    sizes = [rect["value"] for rect in site_rects]
-    if 0 in sizes:
-        sizes = [size if size > 0 else 1 for size in sizes]
-    norm_sizes = squarify.normalize_sizes(sizes, width, height)
-    rects = squarify.padded_squarify(norm_sizes, x, y, width, height)
-
-    for rect, site_rect in zip(rects, site_rects):
-        group_elem = ET.Element("g")
-
-        elem = ET.Element(
-            "rect",
-            x=str(rect["x"]),
-            y=str(rect["y"]),
-            width=str(rect["dx"]),
-            height=str(rect["dy"]),
-            fill=site_rect["color"],
-            id=site_rect["id"],
-            stroke="black",
-            stroke_width="1",
-            data_name=site_rect["name"],
-            data_issues=str(site_rect["issues"]),
-            data_size=str(site_rect["size"]),
+    record_stage("tiles", time.perf_counter() - started)
+
+    with timed_stage("layout"):
+        sizes = [rect["value"] for rect in site_rects]
+        if 0 in sizes:
+            sizes = [size if size > 0 else 1 for size in sizes]
+        norm_sizes = squarify.normalize_sizes(sizes, width, height)
+        rects = squarify.padded_squarify(norm_sizes, x, y, width, height)
+
+        for rect, site_rect in zip(rects, site_rects):
+            site_rect.update(rect)
+
+    return site_rects
+
+
+SVG_NS = "http://www.w3.org/2000/svg"
+# Building plans are still written by ElementTree and must not come out as ns0:svg
+ET.register_namespace("", SVG_NS)
+SVG_COORD_FORMAT = "%.2f"  # Sub-pixel precision is plenty for screen-sized treemaps
+SVG_CHUNK_TILES = 500  # Number of tiles joined into each streamed chunk
+
+
+def svg_escape(value):
+    value = str(value)
+    if "&" in value:
+        value = value.replace("&", "&amp;")
+    if "<" in value:
+        value = value.replace("<", "&lt;")
+    if ">" in value:
+        value = value.replace(">", "&gt;")
+    if '"' in value:
+        value = value.replace('"', "&quot;")
+    return value
+
+
+def iter_treemap_svg(tiles, level, width, height, view_box=None):
+    if view_box is None:
+        view_box = f"0 0 {width} {height}"
+
+    yield "<?xml version='1.0' encoding='utf-8'?>\n"
+    yield f'<svg xmlns="{SVG_NS}" viewBox="{view_box}" width="100%" height="100%">'
+
+    rect_open = (
+        f'<g><rect x="{SVG_COORD_FORMAT}" y="{SVG_COORD_FORMAT}" '
+        f'width="{SVG_COORD_FORMAT}" height="{SVG_COORD_FORMAT}" '
+        'fill="%s" id="%s" stroke="black" stroke_width="1" '
+        'data_name="%s" data_issues="%s" data_size="%s"'
+    )
+    rect_close = f' class="{svg_escape(level)}" /></g>'
+
+    # Only the time spent building chunks counts, not time the consumer holds them
+    elapsed = 0.0
+    started = time.perf_counter()
+    chunk = []
+    for tile in tiles:
+        chunk.append(
+            rect_open % (
+                tile["x"],
+                tile["y"],
+                tile["dx"],
+                tile["dy"],
+                tile["color"],
+                svg_escape(tile["id"]),
+                svg_escape(tile["name"]),
+                tile["issues"],
+                tile["size"],
+            )
         )
-        if level == "site":
-            elem.set("class", "site")
-        elif level == "building":
-            elem.set("class", "building")
-        elif level == "floor":
-            elem.set("class", "floor")
-        elif level == "unit":
-            elem.set("class", "unit")
-        group_elem.append(elem)
+        if "delta" in tile:
+            chunk.append(f' data_delta="{tile["delta"]}"')
+        if "class" in tile:
+            chunk.append(f' class="{svg_escape(tile["class"])}" /></g>')
+        else:
+            chunk.append(rect_close)
+        if len(chunk) >= SVG_CHUNK_TILES * 2:
+            data = "".join(chunk)
+            elapsed += time.perf_counter() - started
+            yield data
+            started = time.perf_counter()
+            chunk = []
+
+    chunk.append("</svg>")
+    data = "".join(chunk)
+    record_stage("serialization", elapsed + time.perf_counter() - started)
+    yield data
+
+
+VIEWPORT_MIN_TILE_PIXELS = 2  # Tiles smaller than this on screen are merged
+VIEWPORT_OTHER_CELL_PIXELS = 16  # Screen size of the grid used to merge them
+
+
+def parse_viewport(value):
+    if not value:
+        return None
+    parts = [float(part) for part in value.split(",")]
+    if len(parts) != 4 or not all(math.isfinite(part) for part in parts) or parts[2] <= 0 or parts[3] <= 0:
+        raise ValueError(f"Invalid viewport: {value}")
+    return tuple(parts)
+
+
+def select_viewport_tiles(tiles, viewport, zoom):
+    vx, vy, vw, vh = viewport
+    cell = VIEWPORT_OTHER_CELL_PIXELS / zoom
+    visible = []
+    others = {}
+
+    for tile in tiles:
+        x0, y0 = tile["x"], tile["y"]
+        x1, y1 = x0 + tile["dx"], y0 + tile["dy"]
+        if x1 <= vx or y1 <= vy or x0 >= vx + vw or y0 >= vy + vh:
+            continue
 
-        new_svg.append(group_elem)
+        if tile["dx"] * zoom >= VIEWPORT_MIN_TILE_PIXELS and tile["dy"] * zoom >= VIEWPORT_MIN_TILE_PIXELS:
+            visible.append(tile)
+            continue
+
+        gx = int((x0 - vx) // cell)
+        gy = int((y0 - vy) // cell)
+        other = others.get((gx, gy))
+        if other is None:
+            other = others[(gx, gy)] = {
+                "x0": x0, "y0": y0, "x1": x1, "y1": y1,
+                "issues": 0, "size": 0, "count": 0, "top": tile,
+            }
+        else:
+            other["x0"] = min(other["x0"], x0)
+            other["y0"] = min(other["y0"], y0)
+            other["x1"] = max(other["x1"], x1)
+            other["y1"] = max(other["y1"], y1)
+        other["issues"] += tile["issues"]
+        other["size"] += tile["size"]
+        other["count"] += 1
+        if tile["issues"] > other["top"]["issues"]:
+            other["top"] = tile
+
+    merged = []
+    for (gx, gy), other in others.items():
+        # Clip to the grid cell so aggregates never spill over their neighbours
+        cell_x0 = vx + gx * cell
+        cell_y0 = vy + gy * cell
+        x0 = max(other["x0"], cell_x0)
+        y0 = max(other["y0"], cell_y0)
+        x1 = min(other["x1"], cell_x0 + cell)
+        y1 = min(other["y1"], cell_y0 + cell)
+        merged.append(
+            {
+                "id": f"other:{gx}:{gy}",
+                "x": x0,
+                "y": y0,
+                "dx": max(x1 - x0, 0),
+                "dy": max(y1 - y0, 0),
+                "color": other["top"]["color"],
+                "name": f"{other['count']} other",
+                "issues": other["issues"],
+                "size": other["size"],
+                "class": "other",
+            }
+        )
+
+    # Aggregates are drawn first so real tiles stay on top
+    return merged + visible
+
+
+def render_viewport_svg(tiles, level, width, height, viewport, zoom):
+    view_box = " ".join(SVG_COORD_FORMAT % value for value in viewport)
+    visible_tiles = select_viewport_tiles(tiles, viewport, zoom)
+    return Response(iter_treemap_svg(visible_tiles, level, width, height, view_box=view_box))
 
-    tree = ET.ElementTree(new_svg)
-    with open(output_file, "wb") as f:
-        tree.write(f, xml_declaration=True, encoding="utf-8")
+
+def get_room_lengths(svg_file):
+    # Keyed on the modification time so replaced floor plans are picked up
+    key = f"{svg_file}:{os.path.getmtime(svg_file)}"
+    room_lengths = geometry_cache.get(key)
+    if room_lengths is not None:
+        return room_lengths
+
+    paths, texts, tree, root = parse_svg(svg_file)
+    min_size = 50
+    closed_paths = identify_closed_paths(paths, min_size)
+    room_associations = generate_room_associations(closed_paths, texts)
+
+    room_lengths = {}
+    for assoc in room_associations:
+        try:
+            room_code = assoc["id"].strip().lower().split(";")[2]
+        except IndexError:
+            continue
+        # The first matching room wins, as it did when searching the list
+        room_lengths.setdefault(room_code, assoc["length"])
+
+    geometry_cache[key] = room_lengths
+    return room_lengths
 
 
 def calculate_unit_size(floor, parent_code):
     site_code, building_code, floor_code = parent_code.split(":")
-    svg_file = f"../Data/Diagrams/{site_code}-{building_code}-{floor_code}.svg"
-    
-    try:
-        paths, texts, tree, root = parse_svg(svg_file)
-        min_size = 50  # Default size for units if no match is found later on
-        closed_paths = identify_closed_paths(paths, min_size)
-        room_associations = generate_room_associations(closed_paths, texts)
-
-        unit_sizes = []
-        for unit in floor.units:
-            matched = False
-            for assoc in room_associations:
-                try:
-                    if (
-                        assoc["id"].strip().lower().split(";")[2]
-                        == unit.unitCode.strip().lower()
-                    ):
-                        unit_size = assoc["length"]
-                        unit_sizes.append((unit.unitCode, unit_size))
-                        matched = True
-                        break
-                except IndexError:
-                    continue
-            if not matched:
-                unit_sizes.append((unit.unitCode, min_size))
-
-        return unit_sizes
+    svg_file = os.path.join(diagrams_dir, f"{site_code}-{building_code}-{floor_code}.svg")
+    min_size = 50  # Default size for units if no match is found later on
 
+    try:
+        room_lengths = get_room_lengths(svg_file)
     except FileNotFoundError:
         return [(unit.unitCode, 50) for unit in floor.units]
 
+    return [
+        (unit.unitCode, room_lengths.get(unit.unitCode.strip().lower(), min_size))
+        for unit in floor.units
+    ]
+
 
 def find_paths_and_texts(element, depth=0):
     paths = []
@@ -694,50 +1222,862 @@ def generate_room_associations(paths, texts):
 def index():
     return send_from_directory(app.static_folder, "index.html")
 
-full_hierarchy = None
+# Runs one computation per key, concurrent callers with the same key wait for it
+# and share its result instead of repeating the work.
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, func):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = {"event": threading.Event(), "result": None, "error": None}
+
+        if not leader:
+            increment("treemap_singleflight_total", (("flight", self.name), ("outcome", "coalesced")))
+            call["event"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"]
+
+        increment("treemap_singleflight_total", (("flight", self.name), ("outcome", "executed")))
+        try:
+            call["result"] = func()
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call["event"].set()
+        return call["result"]
+
+
+# Built hierarchies are kept as immutable snapshots keyed by the normalised
+# filter set. A snapshot is never modified once published, a refresh swaps in
+# a new one, so concurrent requests with different filters never clobber each
+# other. A request keeps using the snapshot it looked up even if it is evicted
+# or replaced meanwhile, so eviction only drops the least recently used
+# filtered snapshots from the lookup table.
+MAX_FILTERED_SNAPSHOTS = 16
+
+snapshot_lock = threading.Lock()
+hierarchy_snapshots = {}
+hierarchy_version = 0  # Bumped whenever the underlying data is invalidated
+hierarchy_flights = SingleFlight("hierarchy")
+
+
+class HierarchySnapshot:
+    def __init__(self, sites, filter_key, version, high_water_mark=0):
+        self.sites = sites
+        self.filter_key = filter_key
+        self.version = version
+        self.high_water_mark = high_water_mark  # Highest Activity Log ID included
+        self.last_used = time.monotonic()
+
+
+def lookup_snapshot(filter_key):
+    with snapshot_lock:
+        snapshot = hierarchy_snapshots.get(filter_key)
+        if snapshot is None or snapshot.version != hierarchy_version:
+            return None
+        snapshot.last_used = time.monotonic()
+        return snapshot
+
+
+def publish_snapshot(snapshot):
+    with snapshot_lock:
+        # Data was invalidated while building, so keep this one private to its request
+        if snapshot.version != hierarchy_version:
+            return
+        current = hierarchy_snapshots.get(snapshot.filter_key)
+        if current is not None and current.high_water_mark > snapshot.high_water_mark:
+            return
+        hierarchy_snapshots[snapshot.filter_key] = snapshot
+
+        filtered = [s for s in hierarchy_snapshots.values() if s.filter_key]
+        filtered.sort(key=lambda s: s.last_used)
+        for stale in filtered[: max(0, len(filtered) - MAX_FILTERED_SNAPSHOTS)]:
+            del hierarchy_snapshots[stale.filter_key]
+
+
+def invalidate_snapshots():
+    global hierarchy_version
+    with snapshot_lock:
+        hierarchy_version += 1
+        hierarchy_snapshots.clear()
+
+
+def build_hierarchy_snapshot(filters, filter_key):
+    version = hierarchy_version
+    # The query is capped at the high-water mark, so the incremental refresh can
+    # pick up exactly the rows after it. Only the persisted unfiltered hierarchy
+    # needs the full stamp, which also counts the rows.
+    data_stamp = get_data_stamp() if not filter_key and snapshot_dir else None
+    high_water_mark = data_stamp["max_log_id"] if data_stamp else get_high_water_mark()
+
+    if data_stamp:
+        sites = load_persisted_hierarchy(data_stamp)
+        if sites is not None:
+            snapshot = HierarchySnapshot(sites, filter_key, version, high_water_mark)
+            publish_snapshot(snapshot)
+            return snapshot
+
+    df = extract_data_from_access(dict(filters, max_log_id=high_water_mark))
+    if df.empty:
+        return None
+    df = generate_color_scale(df)
+    if df.empty:
+        return None
+
+    snapshot = HierarchySnapshot(generate_treemap_data(df), filter_key, version, high_water_mark)
+    publish_snapshot(snapshot)
+    if data_stamp:
+        save_persisted_hierarchy_async(snapshot.sites, data_stamp)
+    return snapshot
+
+
+def save_persisted_hierarchy_async(sites, data_stamp):
+    threading.Thread(target=save_persisted_hierarchy, args=(sites, data_stamp), daemon=True).start()
 
-def generate_full_hierarchy(df):
-    global full_hierarchy
-    full_hierarchy = generate_treemap_data(df)
-    
-def filter_hierarchy(parent_code, level):
-    if full_hierarchy is None:
-        return {}
 
+# The unfiltered hierarchy is persisted as a bundle of NumPy .npy columns, one
+# row per unit sorted by its full path, so that a restarted process can map it
+# instead of aggregating the database and sizing every floor plan again.
+# CURRENT names the live bundle and is swapped atomically when a new one is written.
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_TEXT_COLUMNS = (
+    "unit_path", "site_code", "site_name", "building_code", "building_name",
+    "floor_code", "floor_name", "unit_code", "unit_name",
+)
+SNAPSHOT_NUMBER_COLUMNS = {"issue_count": "<i8", "unit_size": "<f8"}
+SNAPSHOTS_KEPT = 2
+
+snapshot_dir = os.environ.get("TREEMAP_SNAPSHOT_DIR", ".treemap-snapshot")
+persisted_lock = threading.Lock()
+persisted = {"name": None, "manifest": None, "columns": None}
+
+
+def get_data_stamp():
+    conn = get_postgres_connection()
+    if conn is None:
+        raise Exception("Database connection failed.")
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*), MAX("Activity Log ID") FROM "Combined"')
+        count, max_id = cursor.fetchone()
+    finally:
+        conn.close()
+    return {"log_count": int(count), "max_log_id": int(max_id or 0)}
+
+
+def get_diagrams_stamp():
+    try:
+        return max((entry.stat().st_mtime for entry in os.scandir(diagrams_dir)), default=0)
+    except FileNotFoundError:
+        return 0
+
+
+def hierarchy_to_columns(sites):
+    rows = []
+    for site in sites.values():
+        for building in site.buildings:
+            for floor in building.floors:
+                for unit in floor.units:
+                    rows.append(
+                        (
+                            f"{site.siteCode}:{building.buildingCode}:{floor.floorCode}:{unit.unitCode}",
+                            site.siteCode, site.siteName,
+                            building.buildingCode, building.buildingName,
+                            floor.floorCode, floor.floorName,
+                            unit.unitCode, unit.unitName,
+                            unit.issueCount, unit.unitSize,
+                        )
+                    )
+    rows.sort(key=lambda row: row[0])
+
+    columns = {}
+    names = SNAPSHOT_TEXT_COLUMNS + tuple(SNAPSHOT_NUMBER_COLUMNS)
+    for i, name in enumerate(names):
+        values = [row[i] for row in rows]
+        if name in SNAPSHOT_NUMBER_COLUMNS:
+            columns[name] = np.asarray(values, dtype=SNAPSHOT_NUMBER_COLUMNS[name])
+        else:
+            columns[name] = np.asarray([str(value) for value in values], dtype=str)
+    return columns
+
+
+def hierarchy_from_columns(columns):
+    sites = {}
+    rows = zip(
+        columns["site_code"].tolist(), columns["site_name"].tolist(),
+        columns["building_code"].tolist(), columns["building_name"].tolist(),
+        columns["floor_code"].tolist(), columns["floor_name"].tolist(),
+        columns["unit_code"].tolist(), columns["unit_name"].tolist(),
+        columns["issue_count"].tolist(), columns["unit_size"].tolist(),
+    )
+    for siteCode, siteName, buildingCode, buildingName, floorCode, floorName, unitCode, unitName, issueCount, unitSize in rows:
+        site = sites.get(siteCode)
+        if site is None:
+            site = sites[siteCode] = Site(siteCode, siteName)
+            site.buildings_dict = {}
+        building = site.buildings_dict.get(buildingCode)
+        if building is None:
+            building = site.buildings_dict[buildingCode] = Building(buildingCode, buildingName)
+            building.floors_dict = {}
+            site.add_building(building)
+        floor = building.floors_dict.get(floorCode)
+        if floor is None:
+            floor = building.floors_dict[floorCode] = Floor(floorCode, floorName)
+            floor.units_dict = {}
+            building.add_floor(floor)
+        unit = Unit(unitCode, unitName, issueCount)
+        unit.unitSize = unitSize
+        floor.units_dict[unitCode] = unit
+        floor.add_unit(unit)
+    return sites
+
+
+def save_persisted_hierarchy(sites, data_stamp):
+    try:
+        with timed_stage("snapshot_save"):
+            columns = hierarchy_to_columns(sites)
+            os.makedirs(snapshot_dir, exist_ok=True)
+            name = f"v{int(time.time() * 1000)}-{os.getpid()}"
+            tmp_path = os.path.join(snapshot_dir, f"tmp-{name}")
+            os.makedirs(tmp_path)
+            for column, values in columns.items():
+                np.save(os.path.join(tmp_path, f"{column}.npy"), values)
+            manifest = {
+                "format": SNAPSHOT_FORMAT,
+                "created": time.time(),
+                "units": len(columns["unit_path"]),
+                "data_stamp": data_stamp,
+                "diagrams_stamp": get_diagrams_stamp(),
+            }
+            with open(os.path.join(tmp_path, "manifest.json"), "w") as f:
+                json.dump(manifest, f)
+            os.rename(tmp_path, os.path.join(snapshot_dir, name))
+
+            current_tmp = os.path.join(snapshot_dir, f"CURRENT.{name}")
+            with open(current_tmp, "w") as f:
+                f.write(name)
+            os.replace(current_tmp, os.path.join(snapshot_dir, "CURRENT"))
+
+            bundles = sorted(entry for entry in os.listdir(snapshot_dir) if entry.startswith("v"))
+            for old in bundles[:-SNAPSHOTS_KEPT]:
+                shutil.rmtree(os.path.join(snapshot_dir, old), ignore_errors=True)
+    except OSError as e:
+        print(f"Error saving hierarchy snapshot: {e}")
+
+
+def get_persisted_columns():
+    try:
+        with open(os.path.join(snapshot_dir, "CURRENT")) as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None, None
+
+    with persisted_lock:
+        if persisted["name"] != name:
+            path = os.path.join(snapshot_dir, name)
+            try:
+                with open(os.path.join(path, "manifest.json")) as f:
+                    manifest = json.load(f)
+                if manifest.get("format") != SNAPSHOT_FORMAT:
+                    return None, None
+                columns = {
+                    column: np.load(os.path.join(path, f"{column}.npy"), mmap_mode="r")
+                    for column in SNAPSHOT_TEXT_COLUMNS + tuple(SNAPSHOT_NUMBER_COLUMNS)
+                }
+            except (OSError, ValueError) as e:
+                print(f"Error loading hierarchy snapshot {name}: {e}")
+                return None, None
+            persisted.update(name=name, manifest=manifest, columns=columns)
+        return persisted["manifest"], persisted["columns"]
+
+
+def load_persisted_hierarchy(data_stamp):
+    manifest, columns = get_persisted_columns()
+    if manifest is None:
+        return None
+    if manifest["data_stamp"] != data_stamp or manifest["diagrams_stamp"] != get_diagrams_stamp():
+        return None
+    with timed_stage("snapshot_load"):
+        return hierarchy_from_columns(columns)
+
+
+def get_persisted_unit_sizes():
+    if not snapshot_dir:
+        return None
+    manifest, columns = get_persisted_columns()
+    # Sizes only depend on the floor plans, so the data stamp does not matter here
+    if manifest is None or manifest["diagrams_stamp"] != get_diagrams_stamp():
+        return None
+    return columns["unit_path"], columns["unit_size"]
+
+
+def lookup_persisted_unit_sizes(persisted_sizes, floor_path, units):
+    if persisted_sizes is None:
+        return None
+    paths, unit_sizes = persisted_sizes
+    sizes = []
+    for unit in units:
+        key = f"{floor_path}:{unit.unitCode}"
+        index = int(np.searchsorted(paths, key))
+        if index >= len(paths) or paths[index] != key:
+            return None
+        sizes.append(float(unit_sizes[index]))
+    return sizes
+
+
+def sync_shared_cache_generation():
+    global seen_cache_generation, seen_high_water_mark
+    if not isinstance(cache, SharedCache):
+        return
+    meta = cache.meta()
+    generation = meta.get("generation", 0)
+    high_water_mark = meta.get("high_water_mark", 0)
+    if generation != seen_cache_generation:
+        seen_cache_generation = generation
+        seen_high_water_mark = high_water_mark
+        invalidate_snapshots()
+    elif high_water_mark > seen_high_water_mark:
+        # Another worker refreshed and dropped the shared renders, so catch up
+        # before this worker's older snapshots are rendered into them again
+        refresh_hierarchies()
+
+
+def get_hierarchy_snapshot(filters):
+    sync_shared_cache_generation()
+    filter_key = normalize_filters(filters)
+    snapshot = lookup_snapshot(filter_key)
+    if snapshot is not None:
+        return snapshot
+    return hierarchy_flights.do(filter_key, lambda: build_hierarchy_snapshot(filters, filter_key))
+
+
+def filter_hierarchy(sites, parent_code, level):
+    # Returns a view that shares the snapshot's objects, only the containers
+    # that get narrowed are shallow copies.
     filtered_sites = {}
 
     if level == "site":
-        return copy.deepcopy(full_hierarchy)
+        return dict(sites)
 
     elif level == "building":
-        site = copy.deepcopy(full_hierarchy.get(parent_code))
+        site = sites.get(parent_code)
         if site:
             filtered_sites[parent_code] = site
 
     elif level == "floor":
         site_code, building_code = parent_code.split(":")
-        site = copy.deepcopy(full_hierarchy.get(site_code))
+        site = sites.get(site_code)
         if site:
             building = next((b for b in site.buildings if b.buildingCode == building_code), None)
             if building:
+                site = copy.copy(site)
                 site.buildings = [building]
                 filtered_sites[site_code] = site
 
     elif level == "unit":
         site_code, building_code, floor_code = parent_code.split(":")
-        site = copy.deepcopy(full_hierarchy.get(site_code))
+        site = sites.get(site_code)
         if site:
             building = next((b for b in site.buildings if b.buildingCode == building_code), None)
             if building:
                 floor = next((f for f in building.floors if f.floorCode == floor_code), None)
                 if floor:
+                    building = copy.copy(building)
                     building.floors = [floor]
+                    site = copy.copy(site)
                     site.buildings = [building]
                     filtered_sites[site_code] = site
 
     return filtered_sites
 
 
+# Incremental refresh. Every snapshot remembers the highest Activity Log ID it
+# includes, new rows past it are aggregated per unit and added to a copy of the
+# snapshot, and only cache entries on the touched paths are dropped. Changes are
+# noticed by polling the high-water mark, or by LISTEN/NOTIFY when the trigger in
+# sql/activity_notify.sql is installed. Updates and deletes cannot be applied as
+# deltas, a notification about them invalidates everything instead.
+REFRESH_CHANNEL = "combined_changed"
+refresh_interval = float(os.environ.get("TREEMAP_REFRESH_INTERVAL", 0))  # Seconds, 0 disables
+refresh_mode = os.environ.get("TREEMAP_REFRESH_MODE", "poll")  # "poll" or "notify"
+NOTIFY_FALLBACK_INTERVAL = 300  # Seconds, how often notify mode also checks when no interval is set
+refresh_lock = threading.Lock()
+refresh_thread = None
+
+
+def get_high_water_mark():
+    conn = get_postgres_connection()
+    if conn is None:
+        raise Exception("Database connection failed.")
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT MAX("Activity Log ID") FROM "Combined"')
+        return int(cursor.fetchone()[0] or 0)
+    finally:
+        conn.close()
+
+
+def filters_from_key(filter_key):
+    return {name: ",".join(values) for name, values in filter_key}
+
+
+def copy_for_write(node, children, copied):
+    # Shallow copy of a hierarchy node with its own child list and lookup dict,
+    # made once per refresh so untouched parts stay shared with the old snapshot
+    if id(node) in copied:
+        return node
+    clone = copy.copy(node)
+    setattr(clone, children, list(getattr(node, children)))
+    setattr(clone, f"{children}_dict", dict(getattr(node, f"{children}_dict", {})))
+    copied.add(id(clone))
+    return clone
+
+
+def replace_child(parent, children, old, new, key):
+    items = getattr(parent, children)
+    for i, item in enumerate(items):
+        if item is old:
+            items[i] = new
+            break
+    getattr(parent, f"{children}_dict")[key] = new
+
+
+def apply_issue_deltas(sites, df):
+    sites = dict(sites)
+    copied = set()
+    touched = set()
+    new_units = {}
+
+    for row in df.itertuples(index=False, name=None):
+        buildingCode, buildingName, floorCode, unitCode, siteCode, siteName, floorName, unitName, delta = row[:9]
+
+        site = sites.get(siteCode)
+        if site is None:
+            site = Site(siteCode, siteName)
+            site.buildings_dict = {}
+            copied.add(id(site))
+        else:
+            site = copy_for_write(site, "buildings", copied)
+        sites[siteCode] = site
+
+        old_building = site.buildings_dict.get(buildingCode)
+        if old_building is None:
+            building = Building(buildingCode, buildingName)
+            building.floors_dict = {}
+            copied.add(id(building))
+            site.add_building(building)
+            site.buildings_dict[buildingCode] = building
+        else:
+            building = copy_for_write(old_building, "floors", copied)
+            replace_child(site, "buildings", old_building, building, buildingCode)
+
+        old_floor = building.floors_dict.get(floorCode)
+        if old_floor is None:
+            floor = Floor(floorCode, floorName)
+            floor.units_dict = {}
+            copied.add(id(floor))
+            building.add_floor(floor)
+            building.floors_dict[floorCode] = floor
+        else:
+            floor = copy_for_write(old_floor, "units", copied)
+            replace_child(building, "floors", old_floor, floor, floorCode)
+
+        old_unit = floor.units_dict.get(unitCode)
+        if old_unit is None:
+            unit = Unit(unitCode, unitName, int(delta))
+            floor.add_unit(unit)
+            floor.units_dict[unitCode] = unit
+            new_units.setdefault((siteCode, buildingCode, floorCode), []).append(unit)
+        else:
+            unit = copy.copy(old_unit)
+            unit.issueCount = old_unit.issueCount + int(delta)
+            replace_child(floor, "units", old_unit, unit, unitCode)
+
+        touched.add((siteCode, buildingCode, floorCode))
+
+    # Units seen for the first time still need sizing from their floor plan
+    for (siteCode, buildingCode, floorCode), units in new_units.items():
+        pending = Floor(floorCode, "")
+        pending.units = units
+        sizes = dict(calculate_unit_size(pending, f"{siteCode}:{buildingCode}:{floorCode}"))
+        for unit in units:
+            unit.unitSize = sizes.get(unit.unitCode, 50)
+
+    return sites, touched
+
+
+def discard_cache_prefix(store, prefix):
+    if isinstance(store, SharedCache):
+        store.discard_prefix(prefix)
+        return
+    for key in [key for key in list(store) if key.startswith(prefix)]:
+        store.pop(key, None)
+
+
+def invalidate_cached_paths(touched):
+    prefixes = {"site-"}
+    for site_code, building_code, floor_code in touched:
+        prefixes.add(f"building-{site_code}-")
+        prefixes.add(f"floor-{site_code}:{building_code}-")
+        prefixes.add(f"unit-{site_code}:{building_code}:{floor_code}-")
+    for prefix in prefixes:
+        discard_cache_prefix(cache, prefix)
+        discard_cache_prefix(layout_cache, prefix)
+    # Artifacts are rebuilt on demand, so drop them rather than track which are still used
+    artifact_cache.clear()
+    increment("treemap_refresh_invalidated_total", amount=len(prefixes))
+
+
+def refresh_hierarchies():
+    global seen_high_water_mark
+    with refresh_lock:
+        # One stamp for both the refresh range and the persisted bundle, so the
+        # bundle never claims rows that the refreshed hierarchy does not hold
+        data_stamp = get_data_stamp()
+        high_water_mark = data_stamp["max_log_id"]
+        with snapshot_lock:
+            snapshots = [s for s in hierarchy_snapshots.values() if s.version == hierarchy_version]
+
+        touched = set()
+        refreshed = 0
+        for snapshot in snapshots:
+            if snapshot.high_water_mark >= high_water_mark:
+                continue
+            filters = dict(
+                filters_from_key(snapshot.filter_key),
+                min_log_id=snapshot.high_water_mark,
+                max_log_id=high_water_mark,
+            )
+            with timed_stage("refresh"):
+                df = extract_data_from_access(filters)
+                sites, snapshot_touched = apply_issue_deltas(snapshot.sites, df)
+            publish_snapshot(HierarchySnapshot(sites, snapshot.filter_key, snapshot.version, high_water_mark))
+            refreshed += 1
+            if not snapshot.filter_key:
+                # Rendered caches only hold unfiltered views
+                touched |= snapshot_touched
+                if snapshot_dir:
+                    save_persisted_hierarchy_async(sites, data_stamp)
+
+        if isinstance(cache, SharedCache):
+            # Announced before the renders are dropped, so other workers refresh
+            # their own snapshots before rendering into the shared cache again
+            cache.raise_high_water_mark(high_water_mark)
+            seen_high_water_mark = max(seen_high_water_mark, high_water_mark)
+        if touched:
+            invalidate_cached_paths(touched)
+        increment("treemap_refresh_total", (("outcome", "applied" if refreshed else "unchanged"),))
+        return {"high_water_mark": high_water_mark, "snapshots_refreshed": refreshed, "floors_touched": len(touched)}
+
+
+def invalidate_all_data():
+    cache.clear()
+    layout_cache.clear()
+    artifact_cache.clear()
+    invalidate_snapshots()
+    if isinstance(cache, SharedCache):
+        # Deleted rows can lower the highest Activity Log ID, so the mark starts over
+        cache.reset_high_water_mark()
+        cache.bump_generation()
+
+
+def poll_for_changes():
+    while True:
+        time.sleep(refresh_interval)
+        try:
+            refresh_hierarchies()
+        except Exception as e:
+            print(f"Error refreshing hierarchy: {e}")
+
+
+def listen_for_changes(timeout):
+    while True:
+        conn = get_postgres_connection()
+        if conn is None:
+            time.sleep(timeout)
+            continue
+        try:
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            conn.cursor().execute(f"LISTEN {REFRESH_CHANNEL}")
+            while True:
+                # Wake up on a notification, or after the interval as a polling fallback
+                select.select([conn], [], [], timeout)
+                conn.poll()
+                payloads = [notify.payload for notify in conn.notifies]
+                conn.notifies.clear()
+                if "reset" in payloads:
+                    invalidate_all_data()
+                else:
+                    refresh_hierarchies()
+        except Exception as e:
+            print(f"Error listening for changes: {e}")
+            time.sleep(timeout)
+        finally:
+            conn.close()
+
+
+def start_refresh_thread():
+    global refresh_thread
+    if refresh_thread is not None:
+        return
+    if refresh_mode == "notify":
+        timeout = refresh_interval if refresh_interval > 0 else NOTIFY_FALLBACK_INTERVAL
+        refresh_thread = threading.Thread(target=listen_for_changes, args=(timeout,), name="hierarchy-refresh", daemon=True)
+    elif refresh_mode == "poll":
+        if refresh_interval <= 0:
+            return
+        refresh_thread = threading.Thread(target=poll_for_changes, name="hierarchy-refresh", daemon=True)
+    else:
+        print(f"Unknown TREEMAP_REFRESH_MODE {refresh_mode!r}, new activity logs will not be picked up")
+        return
+    refresh_thread.start()
+
+
+FILTER_PARAMS = (
+    "work_request_status",
+    "requested_by",
+    "craftsperson_name",
+    "primary_trade",
+    "time_to_complete",
+    "from",
+    "to",
+    "search",
+)
+DATE_PARAMS = ("from", "to")
+
+
+def get_request_filters():
+    filters = {}
+    for name in FILTER_PARAMS:
+        value = request.args.get(name)
+        if value:
+            if name in DATE_PARAMS:
+                try:
+                    value = date.fromisoformat(value).isoformat()
+                except ValueError:
+                    raise ValueError(f"Invalid '{name}' date, expected YYYY-MM-DD: {value}")
+            filters[name] = value
+    if "from" in filters and "to" in filters and filters["from"] > filters["to"]:
+        raise ValueError("'from' must not be after 'to'.")
+    return filters
+
+
+def tile_issue_counts(sites, level):
+    # Issue counts keyed by the same ids compute_treemap_tiles gives its tiles
+    counts = {}
+    for site_code, site in sites.items():
+        if level == "site":
+            counts[site_code] = site.get_total_issue_count()
+            continue
+        for building in site.buildings:
+            building_path = f"{site_code}:{building.buildingCode}"
+            if level == "building":
+                counts[building_path] = building.get_total_issue_count()
+                continue
+            for floor in building.floors:
+                floor_path = f"{building_path}:{floor.floorCode}"
+                if level == "floor":
+                    counts[floor_path] = floor.get_total_issue_count()
+                    continue
+                for unit in floor.units:
+                    counts[f"{floor_path}:{unit.unitCode}"] = unit.issueCount
+    return counts
+
+
+def load_filtered_hierarchy(filters, level, parent_code):
+    snapshot = get_hierarchy_snapshot(filters)
+    if snapshot is None:
+        return None, ({"error": "No data found for the selected filters."}, 404)
+    return filter_hierarchy(snapshot.sites, parent_code, level), None
+
+
+def error_response(error):
+    body, status = error
+    return (jsonify(body) if isinstance(body, dict) else body), status
+
+
+svg_flights = SingleFlight("generate_svg")
+
+
+def normalize_filters(filters):
+    return tuple(
+        (name, tuple(sorted({value.strip() for value in filters[name].split(",") if value.strip()})))
+        for name in sorted(filters)
+    )
+
+
+def build_svg(level, parent_code, visualization_type, width, height, filters, layout_key, compare=False):
+    # Returns ("tiles", tiles), ("svg", content) or ("error", (body, status)).
+    # Results are shared between coalesced requests, so they must not be mutated.
+    filtered_hierarchy, error = load_filtered_hierarchy(filters, level, parent_code)
+    if error:
+        return "error", error
+    if not filtered_hierarchy:
+        return "error", ({"error": "No data found for the selected parent."}, 404)
+
+    if visualization_type == "squarified" or (visualization_type == "building-plans" and level != "unit"):
+        tiles = compute_treemap_tiles(filtered_hierarchy, level, width, height)
+        if compare:
+            previous_hierarchy, _ = load_filtered_hierarchy(previous_period_filters(filters), level, parent_code)
+            previous_counts = tile_issue_counts(previous_hierarchy or {}, level)
+            for tile in tiles:
+                tile["delta"] = int(tile["issues"]) - int(previous_counts.get(tile["id"], 0))
+        if not filters:
+            layout_cache[layout_key] = tiles
+        return "tiles", tiles
+
+    if visualization_type == "building-plans" and level == "unit":
+        try:
+            issue_counts = [
+                u.issueCount
+                for site in filtered_hierarchy.values()
+                for building in site.buildings
+                for floor in building.floors
+                for u in floor.units
+            ]
+            norm = plt.Normalize(min(issue_counts), max(issue_counts))
+
+            # Render into memory so concurrent requests never share the output file
+            buffer = io.BytesIO()
+            with timed_stage("building_plan"):
+                create_building_plan_visualization(
+                    filtered_hierarchy, parent_code, buffer, norm
+                )
+            return "svg", buffer.getvalue().decode("utf-8")
+
+        except FileNotFoundError:
+            return "error", ({"error": "SVG file not found for the specified floor."}, 404)
+
+    return "error", ("Invalid level", 400)
+
+
+# Cached SVGs are compressed once per encoding and served as-is, so flask_compress
+# (which skips responses that already have a Content-Encoding) stays off the hot path.
+ARTIFACT_GZIP_LEVEL = 9
+ARTIFACT_BROTLI_QUALITY = 9
+
+
+def svg_cache_entry(svg_content, filters, prefetched=False):
+    content_hash = hashlib.sha256(svg_content.encode("utf-8")).hexdigest()
+    return {"svg_content": svg_content, "filters": filters, "content_hash": content_hash, "prefetched": prefetched}
+
+
+def choose_encoding():
+    # Honours q-values, brotli wins ties; None means send the SVG uncompressed
+    encodings = ["br", "gzip"] if brotli is not None else ["gzip"]
+    return request.accept_encodings.best_match(encodings)
+
+
+def compress_artifact(data, encoding):
+    with timed_stage("compression"):
+        if encoding == "br":
+            return brotli.compress(data, quality=ARTIFACT_BROTLI_QUALITY)
+        return gzip.compress(data, compresslevel=ARTIFACT_GZIP_LEVEL, mtime=0)
+
+
+def cached_svg_response(entry):
+    encoding = choose_encoding()
+    if encoding is None or "content_hash" not in entry:
+        response = Response(entry["svg_content"])
+    else:
+        artifact_key = f"{entry['content_hash']}.{encoding}"
+        body = artifact_cache.get(artifact_key)
+        if body is None:
+            body = compress_artifact(entry["svg_content"].encode("utf-8"), encoding)
+            artifact_cache[artifact_key] = body
+        response = Response(body)
+        response.headers["Content-Encoding"] = encoding
+        response.headers["Content-Length"] = str(len(body))
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+# After an unfiltered level is served, the children of its busiest tiles are rendered
+# in the background so the likely next click is already cached.
+CHILD_LEVELS = {"site": "building", "building": "floor", "floor": "unit"}
+PREFETCH_WINDOW = 60
+prefetch_tiles = int(os.environ.get("TREEMAP_PREFETCH_TILES", 3))
+prefetch_budget = float(os.environ.get("TREEMAP_PREFETCH_BUDGET", 15))  # CPU seconds per window
+prefetch_lock = threading.Lock()
+prefetch_pending = set()
+prefetch_spent = []
+prefetch_executor = None
+
+
+def prefetch_budget_left():
+    cutoff = time.monotonic() - PREFETCH_WINDOW
+    with prefetch_lock:
+        while prefetch_spent and prefetch_spent[0][0] < cutoff:
+            prefetch_spent.pop(0)
+        return prefetch_budget - sum(spent for _, spent in prefetch_spent)
+
+
+def prefetch_svg(level, parent_code, visualization_type, width, height):
+    cache_key = f"{level}-{parent_code}-{visualization_type}-{{}}"
+    if cache_key in cache:
+        return
+    if prefetch_budget_left() <= 0:
+        increment("treemap_prefetch_total", (("level", level), ("outcome", "skipped")))
+        return
+
+    started = time.thread_time()
+    try:
+        layout_key = f"{level}-{parent_code}-{{}}-{width}x{height}"
+        flight_key = (level, parent_code, visualization_type, width, height, (), False)
+        kind, result = svg_flights.do(
+            flight_key,
+            lambda: build_svg(level, parent_code, visualization_type, width, height, {}, layout_key),
+        )
+        if kind == "error":
+            return
+        svg_content = "".join(iter_treemap_svg(result, level, width, height)) if kind == "tiles" else result
+        cache[cache_key] = svg_cache_entry(svg_content, {}, prefetched=True)
+        increment("treemap_prefetch_total", (("level", level), ("outcome", "prefetched")))
+    finally:
+        with prefetch_lock:
+            prefetch_spent.append((time.monotonic(), time.thread_time() - started))
+
+
+def run_prefetch(level, parent_code, visualization_type, width, height):
+    try:
+        hierarchy, error = load_filtered_hierarchy({}, level, parent_code)
+        if error or not hierarchy:
+            return
+        counts = tile_issue_counts(hierarchy, level)
+        busiest = sorted(counts, key=lambda tile_id: counts[tile_id], reverse=True)[:prefetch_tiles]
+        for tile_id in busiest:
+            prefetch_svg(CHILD_LEVELS[level], tile_id, visualization_type, width, height)
+    except Exception as e:
+        print(f"Error prefetching children of {level} {parent_code}: {str(e)}")
+    finally:
+        with prefetch_lock:
+            prefetch_pending.discard((level, parent_code, visualization_type, width, height))
+
+
+def schedule_prefetch(level, parent_code, visualization_type, width, height):
+    global prefetch_executor
+    if prefetch_tiles <= 0 or level not in CHILD_LEVELS:
+        return
+    key = (level, parent_code, visualization_type, width, height)
+    with prefetch_lock:
+        if key in prefetch_pending:
+            return
+        prefetch_pending.add(key)
+        if prefetch_executor is None:
+            prefetch_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+    prefetch_executor.submit(run_prefetch, *key)
+
+
 @app.route("/generate_svg", methods=["GET"])
 def generate_svg():
     level = request.args.get("level")
@@ -746,97 +2086,178 @@ def generate_svg():
     width = int(request.args.get("width", 1920))
     height = int(request.args.get("height", 930))
 
-    filters = {}
-    work_request_status = request.args.get("work_request_status")
-    requested_by = request.args.get("requested_by")
-    craftsperson_name = request.args.get("craftsperson_name")
-    primary_trade = request.args.get("primary_trade")
-    time_to_complete = request.args.get("time_to_complete")
-
-    if work_request_status:
-        filters["work_request_status"] = work_request_status
-    if requested_by:
-        filters["requested_by"] = requested_by
-    if craftsperson_name:
-        filters["craftsperson_name"] = craftsperson_name
-    if primary_trade:
-        filters["primary_trade"] = primary_trade
-    if time_to_complete:
-        filters["time_to_complete"] = time_to_complete
+    try:
+        filters = get_request_filters()
+        viewport = parse_viewport(request.args.get("viewport"))
+        zoom = float(request.args.get("zoom", 1))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not math.isfinite(zoom) or zoom <= 0:
+        return jsonify({"error": "Zoom must be a positive number."}), 400
+
+    # Period-over-period comparison against the window of the same length just before "from"
+    compare = request.args.get("compare") == "previous"
+    if compare and not ("from" in filters and "to" in filters):
+        return jsonify({"error": "compare=previous needs both 'from' and 'to'."}), 400
 
     cache_key = f"{level}-{parent_code}-{visualization_type}-{filters}"
+    layout_key = f"{level}-{parent_code}-{filters}-{width}x{height}"
 
     use_cache = not bool(filters)  # Use cache only if no filters are applied
-    if use_cache and cache_key in cache:
-        svg_content = cache[cache_key]["svg_content"]
-    else:
-        df = extract_data_from_access(filters)
-        if df.empty:
-            return jsonify({"error": "No data found for the selected filters."}), 404
-        df = generate_color_scale(df)
-        if df.empty:
-            return jsonify({"error": "No valid data after applying color scale."}), 404
+    if use_cache and viewport is not None:
+        tiles = layout_cache.get(layout_key)
+        if tiles is not None:
+            return render_viewport_svg(tiles, level, width, height, viewport, zoom)
+
+    if use_cache and viewport is None:
+        entry = cache.get(cache_key)
+        if entry is None and level in CHILD_LEVELS.values():
+            increment("treemap_prefetch_total", (("level", level), ("outcome", "miss")))
+        elif entry is not None:
+            if entry.get("prefetched"):
+                # Count each prefetched render once, on its first use
+                increment("treemap_prefetch_total", (("level", level), ("outcome", "hit")))
+                cache[cache_key] = dict(entry, prefetched=False)
+            schedule_prefetch(level, parent_code, visualization_type, width, height)
+            return cached_svg_response(entry)
+
+    # Identical concurrent requests wait for a single computation
+    flight_key = (level, parent_code, visualization_type, width, height, normalize_filters(filters), compare)
+    kind, result = svg_flights.do(
+        flight_key,
+        lambda: build_svg(level, parent_code, visualization_type, width, height, dict(filters), layout_key, compare),
+    )
+
+    if kind == "error":
+        return error_response(result)
 
+    if kind == "tiles":
+        if viewport is not None:
+            return render_viewport_svg(result, level, width, height, viewport, zoom)
+        svg_chunks = iter_treemap_svg(result, level, width, height)
         if not use_cache:
-            generate_full_hierarchy(df)
-             
-        if level == "site" and (full_hierarchy is None):
-            generate_full_hierarchy(df)
+            # Nothing to keep, so stream the chunks straight into the response
+            return Response(svg_chunks)
+        svg_content = "".join(svg_chunks)
+    else:
+        svg_content = result
 
-        filtered_hierarchy = filter_hierarchy(parent_code, level)
+    if use_cache:
+        entry = svg_cache_entry(svg_content, filters)
+        cache[cache_key] = entry
+        schedule_prefetch(level, parent_code, visualization_type, width, height)
+        return cached_svg_response(entry)
 
-        if filtered_hierarchy:
-            if visualization_type == "squarified" or (visualization_type == "building-plans" and level != "unit"):
-                create_interactive_treemap(
-                    filtered_hierarchy, level, output_svg_file, width, height
-                )
-            elif visualization_type == "building-plans" and level == "unit":
-                try:
-                    min_size = min(
-                        [
-                            unit.unitSize
-                            for site in filtered_hierarchy.values()
-                            for building in site.buildings
-                            for floor in building.floors
-                            for unit in floor.units
-                        ]
-                    )
-                    issue_counts = [
-                        u.issueCount
-                        for site in filtered_hierarchy.values()
-                        for building in site.buildings
-                        for floor in building.floors
-                        for u in floor.units
-                    ]
-                    norm = plt.Normalize(min(issue_counts), max(issue_counts))
-
-                    create_building_plan_visualization(
-                        filtered_hierarchy, parent_code, output_svg_file, norm
-                    )
+    return svg_content
 
-                except FileNotFoundError:
-                    return jsonify({"error": "SVG file not found for the specified floor."}), 404
-            else:
-                return "Invalid level", 400
 
-        with open(output_svg_file, "r") as f:
-            svg_content = f.read()
+# Binary layout format, all little-endian:
+#   b"TMAP", uint16 version, uint16 reserved, uint32 header length,
+#   UTF-8 JSON header (level, width, height, count, palette, id, name),
+#   padded to a multiple of 4 bytes, then one column after another:
+#   float32 x, y, dx, dy, size, uint32 issues, uint16 colour index.
+LAYOUT_BINARY_MAGIC = b"TMAP"
+LAYOUT_BINARY_VERSION = 1
+
+
+def build_layout_columns(tiles, level, width, height):
+    palette = []
+    palette_index = {}
+    color_column = []
+    for tile in tiles:
+        index = palette_index.get(tile["color"])
+        if index is None:
+            index = palette_index[tile["color"]] = len(palette)
+            palette.append(tile["color"])
+        color_column.append(index)
+
+    return {
+        "level": level,
+        "width": width,
+        "height": height,
+        "count": len(tiles),
+        "palette": palette,
+        "columns": {
+            "id": [tile["id"] for tile in tiles],
+            "name": [tile["name"] for tile in tiles],
+            "x": [round(tile["x"], 2) for tile in tiles],
+            "y": [round(tile["y"], 2) for tile in tiles],
+            "dx": [round(tile["dx"], 2) for tile in tiles],
+            "dy": [round(tile["dy"], 2) for tile in tiles],
+            "color": color_column,
+            "issues": [int(tile["issues"]) for tile in tiles],
+            "size": [round(float(tile["size"]), 2) for tile in tiles],
+        },
+    }
+
+
+def pack_layout_binary(layout):
+    columns = layout["columns"]
+    header = json.dumps(
+        {
+            "level": layout["level"],
+            "width": layout["width"],
+            "height": layout["height"],
+            "count": layout["count"],
+            "palette": layout["palette"],
+            "id": columns["id"],
+            "name": columns["name"],
+        },
+        separators=(",", ":"),
+    ).encode("utf-8")
+    header += b" " * (-len(header) % 4)
+
+    parts = [
+        LAYOUT_BINARY_MAGIC,
+        struct.pack("<HHI", LAYOUT_BINARY_VERSION, 0, len(header)),
+        header,
+    ]
+    for name in ("x", "y", "dx", "dy", "size"):
+        parts.append(np.asarray(columns[name], dtype="<f4").tobytes())
+    parts.append(np.asarray(columns["issues"], dtype="<u4").tobytes())
+    parts.append(np.asarray(columns["color"], dtype="<u2").tobytes())
+    return b"".join(parts)
+
+
+@app.route("/treemap_layout", methods=["GET"])
+def treemap_layout():
+    level = request.args.get("level", "site")
+    parent_code = request.args.get("parent_code")
+    width = int(request.args.get("width", 1920))
+    height = int(request.args.get("height", 930))
+    output_format = request.args.get("format", "json")
+    if output_format not in ("json", "binary"):
+        return jsonify({"error": f"Unknown format: {output_format}"}), 400
 
+    try:
+        filters = get_request_filters()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    layout_key = f"{level}-{parent_code}-{filters}-{width}x{height}"
+    use_cache = not bool(filters)
+
+    tiles = layout_cache.get(layout_key) if use_cache else None
+    if tiles is None:
+        filtered_hierarchy, error = load_filtered_hierarchy(filters, level, parent_code)
+        if error:
+            return error_response(error)
+        if not filtered_hierarchy:
+            return jsonify({"error": "No data found for the selected parent."}), 404
+        tiles = compute_treemap_tiles(filtered_hierarchy, level, width, height)
         if use_cache:
-            cache[cache_key] = {"svg_content": svg_content, "filters": filters}
+            layout_cache[layout_key] = tiles
 
-    return svg_content
+    layout = build_layout_columns(tiles, level, width, height)
+    if output_format == "binary":
+        return Response(pack_layout_binary(layout), mimetype="application/octet-stream")
+    return jsonify(layout)
 
 
 @app.route("/clear_cache_and_filters", methods=["POST"])
 def clear_cache_and_filters():
     try:
-        global full_hierarchy
-        # Clear the in-memory cache
-        cache.clear()
-        
-        # Reset the hierarchy data to ensure filters are cleared
-        full_hierarchy = None
+        # Clear the caches and hierarchy snapshots in every worker
+        invalidate_all_data()
         
         return "Filters and cache cleared successfully", 200
     except Exception as e:
@@ -844,6 +2265,214 @@ def clear_cache_and_filters():
 
 
 
+@app.route("/refresh_data", methods=["POST"])
+def refresh_data():
+    try:
+        return jsonify(refresh_hierarchies())
+    except Exception as e:
+        return jsonify({"error": f"Error refreshing data: {str(e)}"}), 500
+
+
+BATCH_MAX_UNITS = 5000
+
+
+@app.route("/get_unit_problems_batch", methods=["GET", "POST"])
+def get_unit_problems_batch():
+    payload = request.get_json(silent=True)
+    if payload is None:
+        payload = {}
+    if not isinstance(payload, dict):
+        return jsonify({"error": "The request body must be a JSON object."}), 400
+    unit_codes = payload.get("unit_codes")
+    if unit_codes is None:
+        unit_codes = [code for code in request.args.get("unit_codes", "").split(",") if code]
+    floor = payload.get("floor") or request.args.get("floor")
+    limit_per_unit = payload.get("limit_per_unit", request.args.get("limit_per_unit"))
+
+    if not isinstance(unit_codes, list) or not all(isinstance(code, str) for code in unit_codes):
+        return jsonify({"error": "unit_codes must be a list of strings."}), 400
+    if floor is not None and not isinstance(floor, str):
+        return jsonify({"error": "floor must be a string."}), 400
+    if not unit_codes and not floor:
+        return jsonify({"error": "unit_codes or floor is required."}), 400
+    if len(unit_codes) > BATCH_MAX_UNITS:
+        return jsonify({"error": f"At most {BATCH_MAX_UNITS} unit codes per request."}), 400
+
+    try:
+        filters = get_request_filters()
+        if filters.get("requested_by"):
+            raise ValueError("Not supported by /get_unit_problems_batch: requested_by")
+        if limit_per_unit is not None:
+            try:
+                limit_per_unit = int(limit_per_unit)
+            except (TypeError, ValueError):
+                limit_per_unit = 0
+            if limit_per_unit <= 0:
+                raise ValueError("limit_per_unit must be a positive integer.")
+        # Unit codes come as site:building:floor:unit from the treemap or building;floor;unit from floor plans
+        unit_paths = []
+        room_codes = []
+        for code in unit_codes:
+            if len(code.split(":")) == 4:
+                unit_paths.append(tuple(code.split(":")))
+            elif len(code.split(";")) == 3:
+                room_codes.append(tuple(code.split(";")))
+            else:
+                raise ValueError(f"Invalid unit code: {code}")
+        floor_parts = tuple(floor.split(":")) if floor else None
+        if floor_parts is not None and len(floor_parts) != 3:
+            raise ValueError(f"Invalid floor: {floor}")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    selections = []
+    params = {}
+    if unit_paths:
+        selections.append('("Location"."Site Code", "Location"."Building Code", "Location"."Floor Code", "Unit"."Unit Code") IN %(unit_paths)s')
+        params["unit_paths"] = tuple(unit_paths)
+    if room_codes:
+        selections.append('("Location"."Building Code", "Location"."Floor Code", "Unit"."Unit Code") IN %(room_codes)s')
+        params["room_codes"] = tuple(room_codes)
+    if floor_parts is not None:
+        selections.append('("Location"."Site Code" = %(site)s AND "Location"."Building Code" = %(building)s AND "Location"."Floor Code" = %(floor)s)')
+        params.update(site=floor_parts[0], building=floor_parts[1], floor=floor_parts[2])
+
+    conditions, join_craftsperson = bound_filter_conditions(filters, params)
+
+    query = f"""
+    SELECT "Activity Log ID", "Work Description", "Site Code", "Building Code", "Floor Code", "Unit Code", unit_total
+    FROM (
+        SELECT 
+            "Combined"."Activity Log ID", 
+            "Combined"."Work Description",
+            "Location"."Site Code",
+            "Location"."Building Code",
+            "Location"."Floor Code",
+            "Unit"."Unit Code",
+            ROW_NUMBER() OVER unit_logs AS unit_row,
+            COUNT(*) OVER (PARTITION BY "Location"."Site Code", "Location"."Building Code", "Location"."Floor Code", "Unit"."Unit Code") AS unit_total
+        FROM "Combined"
+        INNER JOIN "Location" ON "Combined"."LocationID" = "Location"."LocationID"
+        INNER JOIN "Unit" ON "Location"."UnitID" = "Unit"."UnitID"
+        {'INNER JOIN "Craftsperson" ON "Combined"."Craftsperson Code" = "Craftsperson"."Craftsperson Code"' if join_craftsperson else ''}
+        WHERE ({" OR ".join(selections)})
+        {conditions}
+        {time_to_complete_condition(filters)}
+        {date_range_condition(filters)}
+        {f"AND {SEARCH_VECTOR} @@ plainto_tsquery('{SEARCH_CONFIG}', %(search)s)" if filters.get("search") else ""}
+        WINDOW unit_logs AS (
+            PARTITION BY "Location"."Site Code", "Location"."Building Code", "Location"."Floor Code", "Unit"."Unit Code"
+            ORDER BY "Combined"."Activity Log ID" DESC
+        )
+    ) AS ranked
+    {"WHERE unit_row <= %(limit_per_unit)s" if limit_per_unit is not None else ""}
+    ORDER BY "Site Code", "Building Code", "Floor Code", "Unit Code", "Activity Log ID" DESC
+    """
+    if limit_per_unit is not None:
+        params["limit_per_unit"] = limit_per_unit
+    if filters.get("search"):
+        params["search"] = filters["search"]
+
+    conn = get_postgres_connection()
+    if conn is None:
+        return jsonify({"error": "Database connection failed."}), 500
+    try:
+        with timed_stage("db_query"):
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+    except psycopg2.Error as e:
+        error_message = f"Database query error: {str(e)}"
+        print(error_message)
+        return jsonify({"error": error_message}), 500
+    finally:
+        conn.close()
+
+    units = {}
+    for log_id, description, site_code, building_code, floor_code, unit_code, unit_total in rows:
+        path = f"{site_code}:{building_code}:{floor_code}:{unit_code}"
+        unit = units.get(path)
+        if unit is None:
+            unit = units[path] = {"total": unit_total, "truncated": False, "problems": []}
+        unit["problems"].append({"log_id": log_id, "description": description})
+    for unit in units.values():
+        unit["truncated"] = len(unit["problems"]) < unit["total"]
+
+    return jsonify({"units": units})
+
+
+@app.route("/search_problems", methods=["GET"])
+def search_problems():
+    search_text = request.args.get("q", "").strip()
+    if not search_text:
+        return jsonify({"error": "Search text is required."}), 400
+
+    order = request.args.get("order", "recent")
+    if order not in ("recent", "rank"):
+        return jsonify({"error": f"Unknown order: {order}"}), 400
+    try:
+        limit = max(1, min(int(request.args.get("limit", 100)), SEARCH_MAX_LIMIT))
+        filters = get_request_filters()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    unsupported = [name for name in ("time_to_complete", "search") if filters.get(name)]
+    if unsupported:
+        return jsonify({"error": f"Not supported by /search_problems: {', '.join(unsupported)}"}), 400
+    params = {"q": search_text, "limit": limit}
+    conditions, join_craftsperson = bound_filter_conditions(filters, params)
+
+    conn = get_postgres_connection()
+    if conn is None:
+        return jsonify({"error": "Database connection failed."}), 500
+
+    # Ranking re-reads every matching description, newest first can stop at the limit
+    if order == "rank":
+        order_by = f"ts_rank({SEARCH_VECTOR}, plainto_tsquery('{SEARCH_CONFIG}', %(q)s)) DESC"
+    else:
+        order_by = '"Combined"."Activity Log ID" DESC'
+
+    query = f"""
+    SELECT 
+        "Combined"."Activity Log ID", 
+        "Combined"."Work Description",
+        "Location"."Site Code",
+        "Location"."Building Code",
+        "Location"."Floor Code",
+        "Unit"."Unit Code"
+    FROM "Combined"
+    INNER JOIN "Location" ON "Combined"."LocationID" = "Location"."LocationID"
+    INNER JOIN "Unit" ON "Location"."UnitID" = "Unit"."UnitID"
+    {'INNER JOIN "Craftsperson" ON "Combined"."Craftsperson Code" = "Craftsperson"."Craftsperson Code"' if join_craftsperson else ''}
+    WHERE {SEARCH_VECTOR} @@ plainto_tsquery('{SEARCH_CONFIG}', %(q)s)
+    {conditions}
+    {date_range_condition(filters)}
+    ORDER BY {order_by}
+    LIMIT %(limit)s
+    """
+
+    try:
+        with timed_stage("db_query"):
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+    except psycopg2.Error as e:
+        error_message = f"Database query error: {str(e)}"
+        print(error_message)
+        return jsonify({"error": error_message}), 500
+    finally:
+        conn.close()
+
+    results = [
+        {
+            "log_id": row[0],
+            "description": row[1],
+            "path": f"{row[2]}:{row[3]}:{row[4]}:{row[5]}",
+        }
+        for row in rows
+    ]
+    return jsonify({"query": search_text, "count": len(results), "results": results})
+
+
 @app.route("/get_filter_options", methods=["GET"])
 def get_filter_options():
     conn = get_postgres_connection()
@@ -858,19 +2487,20 @@ def get_filter_options():
     }
 
     try:
-        cursor = conn.cursor()
+        with timed_stage("db_query"):
+            cursor = conn.cursor()
 
-        cursor.execute('SELECT DISTINCT "Work Request Status" FROM "Combined"')
-        options["work_request_status"] = [row[0] for row in cursor.fetchall()]
+            cursor.execute('SELECT DISTINCT "Work Request Status" FROM "Combined"')
+            options["work_request_status"] = [row[0] for row in cursor.fetchall()]
 
-        cursor.execute('SELECT DISTINCT "Requested by" FROM "Combined"')
-        options["requested_by"] = [row[0] for row in cursor.fetchall()]
+            cursor.execute('SELECT DISTINCT "Requested by" FROM "Combined"')
+            options["requested_by"] = [row[0] for row in cursor.fetchall()]
 
-        cursor.execute('SELECT DISTINCT "Craftsperson Name" FROM "Craftsperson"')
-        options["craftsperson_name"] = [row[0] for row in cursor.fetchall()]
+            cursor.execute('SELECT DISTINCT "Craftsperson Name" FROM "Craftsperson"')
+            options["craftsperson_name"] = [row[0] for row in cursor.fetchall()]
 
-        cursor.execute('SELECT DISTINCT "Primary Trade" FROM "Craftsperson"')
-        options["primary_trade"] = [row[0] for row in cursor.fetchall()]
+            cursor.execute('SELECT DISTINCT "Primary Trade" FROM "Craftsperson"')
+            options["primary_trade"] = [row[0] for row in cursor.fetchall()]
 
     except psycopg2.Error as e:
         error_message = f"Database query error: {str(e)}"
@@ -895,6 +2525,11 @@ def get_unit_problems():
     if not code:
         return "Unit code is required", 400
 
+    try:
+        date_filters = {name: value for name, value in get_request_filters().items() if name in DATE_PARAMS}
+    except ValueError as e:
+        return str(e), 400
+
     site_code = ""
     if len(code.split(":")) == 4:
         site_code, building_code, floor_code, unit_code = code.split(":")
@@ -939,11 +2574,13 @@ def get_unit_problems():
         trade_list = ", ".join([f"'{trade.strip()}'" for trade in trades])
         query += f' AND "Craftsperson"."Primary Trade" IN ({trade_list})'
 
+    query += date_range_condition(date_filters)
+
     try:
-        print("Executing ", query)
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        conn.close()
+        with timed_stage("db_query"):
+            cursor.execute(query)
+            rows = cursor.fetchall()
+            conn.close()
 
         problems = [{"log_id": row[0], "description": row[1]} for row in rows]
         return jsonify(problems)
@@ -958,4 +2595,7 @@ def get_unit_problems():
 
 
 if __name__ == "__main__":
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        # Only in the reloader's child, which is the process serving requests
+        start_refresh_thread()
     app.run(debug=True, port=5001)
@@ -0,0 +1,10 @@
+-- Lets date-windowed treemaps (from/to on /generate_svg and /get_unit_problems)
+-- skip old activity logs. Logs are appended roughly in request order, so a BRIN
+-- index stays tiny and lets a "last 30 days" query read only the most recent
+-- block ranges instead of all of "Combined".
+
+CREATE INDEX IF NOT EXISTS combined_date_requested_brin
+    ON "Combined" USING BRIN ("Date and Time Requested")
+    WITH (pages_per_range = 32);
+
+ANALYZE "Combined";
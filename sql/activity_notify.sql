@@ -0,0 +1,20 @@
+-- Notifies the treemap server about changes to "Combined" so it can refresh
+-- incrementally (run it with TREEMAP_REFRESH_MODE=notify).
+-- New rows are picked up as deltas past the server's high-water mark,
+-- updates and deletes make the server invalidate everything.
+
+CREATE OR REPLACE FUNCTION notify_combined_changed() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM pg_notify('combined_changed', 'insert');
+    ELSE
+        PERFORM pg_notify('combined_changed', 'reset');
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS combined_changed ON "Combined";
+CREATE TRIGGER combined_changed
+    AFTER INSERT OR UPDATE OR DELETE ON "Combined"
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_combined_changed();
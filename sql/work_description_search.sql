@@ -0,0 +1,8 @@
+-- Full-text index behind /search_problems and the "search" filter on
+-- /generate_svg. The expression must stay identical to SEARCH_VECTOR in
+-- server.py or Postgres will not use the index.
+
+CREATE INDEX IF NOT EXISTS combined_work_description_fts
+    ON "Combined" USING GIN (to_tsvector('english', coalesce("Work Description", '')));
+
+ANALYZE "Combined";
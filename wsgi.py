@@ -0,0 +1,26 @@
+import os
+
+# Workers share rendered output through this directory unless told otherwise,
+# it has to be set before the server module is imported.
+os.environ.setdefault("TREEMAP_SHARED_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".treemap-cache"))
+
+from server import app, shutdown_unit_size_pool, start_refresh_thread, start_unit_size_pool  # noqa: E402
+
+application = app
+
+
+if __name__ == "__main__":
+    # Single process, multi-threaded server for platforms without gunicorn (e.g. Windows)
+    from waitress import serve
+
+    start_unit_size_pool()
+    start_refresh_thread()
+    try:
+        serve(
+            app,
+            host=os.environ.get("TREEMAP_HOST", "127.0.0.1"),
+            port=int(os.environ.get("TREEMAP_PORT", 5001)),
+            threads=int(os.environ.get("TREEMAP_THREADS", 8)),
+        )
+    finally:
+        shutdown_unit_size_pool()